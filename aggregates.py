@@ -0,0 +1,99 @@
+import json
+from collections import defaultdict
+from sqlalchemy import delete, insert, select
+from models import db, Series, Shot, DailyAggregate, METRIC_COLUMNS
+from metrics import compute_metrics
+from aggregation import day_range, local_date
+
+
+def compute_daily_aggregates(user_id, dates, tz):
+    """DailyAggregate row dicts of the given local dates in timezone tz from the stored
+    series, days without series have none."""
+    # One range query covers all dates, days in between that were not asked for are dropped
+    start, end = day_range(min(dates), max(dates), tz)
+
+    series = db.session.execute(
+        select(Series.id, Series.created_at, Series.total_points)
+        .where(Series.user_id == user_id, Series.created_at >= start, Series.created_at < end)
+    ).all()
+    shots = db.session.execute(
+        select(Series.created_at, Shot.x, Shot.y)
+        .join(Shot, Shot.series_id == Series.id)
+        .where(Series.user_id == user_id, Series.created_at >= start, Series.created_at < end,
+               Shot.x.isnot(None), Shot.y.isnot(None))
+        .order_by(Series.created_at, Shot.id)
+    ).all()
+
+    totals = defaultdict(lambda: [0, 0.0])
+    for _, created_at, total_points in series:
+        day = totals[local_date(created_at, tz)]
+        day[0] += 1
+        day[1] += total_points
+
+    pooled = defaultdict(list)
+    for created_at, x, y in shots:
+        pooled[local_date(created_at, tz)].append([x, y])
+
+    rows = []
+    for date in dates:
+        if date not in totals:
+            continue
+
+        n_series, total_points = totals[date]
+        row = {
+            'user_id': user_id,
+            'date': date,
+            'timezone': str(tz),
+            'n_series': n_series,
+            'n_shots': len(pooled[date]),
+            'total_points': total_points,
+            'shots': json.dumps(pooled[date])
+        }
+        if pooled[date]:
+            metrics = compute_metrics(pooled[date])
+            row.update({column: metrics[name] for name, column in METRIC_COLUMNS.items()})
+        rows.append(row)
+
+    return rows
+
+
+def refresh_daily_aggregates(user_id, dates, tz):
+    """Recompute the daily aggregates of the given local dates in timezone tz from the
+    stored series. The caller owns the transaction."""
+    dates = set(dates)
+    if not dates:
+        return
+
+    rows = compute_daily_aggregates(user_id, dates, tz)
+    db.session.execute(
+        delete(DailyAggregate)
+        .where(DailyAggregate.user_id == user_id, DailyAggregate.date.in_(dates)))
+    if rows:
+        db.session.execute(insert(DailyAggregate), rows)
+
+
+def rebuild_daily_aggregates(user_id, tz):
+    """Replace all daily aggregates of the user by those of timezone tz, a month of
+    days at a time. The caller owns the transaction."""
+    db.session.execute(delete(DailyAggregate).where(DailyAggregate.user_id == user_id))
+
+    months = defaultdict(set)
+    for created_at in db.session.execute(select(Series.created_at).where(Series.user_id == user_id)).scalars():
+        date = local_date(created_at, tz)
+        months[date.year, date.month].add(date)
+
+    for _, dates in sorted(months.items()):
+        refresh_daily_aggregates(user_id, dates, tz)
+
+
+def get_daily_aggregate(user_id, date, tz):
+    """Return the aggregate of a local day, None if there are no series on the day.
+    Days without a stored aggregate of the timezone, imported before aggregates
+    existed, are computed without storing them: requests only read, the importer and
+    timezone changes write the aggregates."""
+    aggregate = db.session.get(DailyAggregate, (user_id, date))
+    if aggregate is not None and aggregate.timezone == str(tz):
+        return aggregate
+
+    rows = compute_daily_aggregates(user_id, {date}, tz)
+    return DailyAggregate(**rows[0]) if rows else None
@@ -0,0 +1,216 @@
+import os
+from collections import defaultdict
+from functools import lru_cache
+from datetime import date, datetime, time, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+from sqlalchemy import case, func, literal_column, select
+from models import db, Series
+
+# Timestamps are stored as naive UTC. Each dialect gets expressions that shift a
+# timestamp into the user's timezone and truncate it to its day or the Monday of
+# its ISO week. Dialects without them fall back to bucketing in Python.
+
+
+@lru_cache(maxsize=None)
+def local_zone_name():
+    """IANA name of the server's timezone from TZ or /etc/localtime, UTC if unknown.
+    A fixed offset from the clock would be wrong for half of the year."""
+    name = os.environ.get('TZ', '').lstrip(':')
+    if not name:
+        path = os.path.realpath('/etc/localtime')
+        if '/zoneinfo/' in path:
+            name = path.split('/zoneinfo/', 1)[1]
+
+    try:
+        ZoneInfo(name)
+    except (ValueError, ZoneInfoNotFoundError):
+        return 'UTC'
+    return name
+
+
+def get_zone(name, default=None):
+    """ZoneInfo of an IANA timezone name, of default or the server's timezone if None."""
+    return ZoneInfo(name or default or local_zone_name())
+
+
+def to_utc(dt):
+    # Aware datetime to the naive UTC of the database
+    return dt.astimezone(timezone.utc).replace(tzinfo=None)
+
+
+def local_date(ts, tz):
+    return ts.replace(tzinfo=timezone.utc).astimezone(tz).date()
+
+
+def day_range(first, last, tz):
+    """Half-open naive UTC range [start, end) of the local days first to last.
+    Filtering created_at by range keeps the (user_id, created_at) index usable."""
+    start = datetime.combine(first, time.min, tzinfo=tz)
+    end = datetime.combine(last + timedelta(days=1), time.min, tzinfo=tz)
+    return to_utc(start), to_utc(end)
+
+
+def utc_offset_minutes(tz, at=None):
+    """UTC offset of a tzinfo in whole minutes at the given UTC datetime (default now)."""
+    at = (at or datetime.utcnow()).replace(tzinfo=timezone.utc)
+    return int(at.astimezone(tz).utcoffset().total_seconds() // 60)
+
+
+@lru_cache(maxsize=64)
+def offset_periods(tz, first_year, last_year):
+    """Periods of constant UTC offset of tz between the years as (start, offset_minutes)
+    tuples, start is naive UTC and None for the first period."""
+    periods = [(None, utc_offset_minutes(tz, datetime(first_year, 1, 1)))]
+    day = datetime(first_year, 1, 1)
+    end = datetime(last_year + 1, 1, 1)
+    while day < end:
+        next_day = day + timedelta(days=1)
+        offset = utc_offset_minutes(tz, next_day)
+        if offset != periods[-1][1]:
+            # Bisect to the minute of the change
+            low, high = day, next_day
+            while high - low > timedelta(minutes=1):
+                middle = low + (high - low) / 2
+                if utc_offset_minutes(tz, middle) == offset:
+                    high = middle
+                else:
+                    low = middle
+            periods.append((high.replace(second=0, microsecond=0), offset))
+        day = next_day
+
+    return periods
+
+
+def _sqlite_offset(column, tz, start, end):
+    # SQLite has no timezone database, DST is handled by a CASE over the offset changes
+    # between start and end
+    periods = offset_periods(tz, start.year, end.year)
+    first = max(i for i, (period_start, _) in enumerate(periods) if period_start is None or period_start <= start)
+    periods = [(None, periods[first][1])] + [period for period in periods[first + 1:] if period[0] <= end]
+    if len(periods) == 1:
+        return periods[0][1], f'{periods[0][1]:+d} minutes'
+
+    whens = [(column < start, f'{offset:+d} minutes')
+             for (_, offset), (start, _) in zip(periods, periods[1:])]
+    return None, case(*whens, else_=f'{periods[-1][1]:+d} minutes')
+
+
+def _sqlite_week_start(column, tz, start, end):
+    # 'weekday 0' moves forward to Sunday (or stays), going back six days lands on Monday
+    _, modifier = _sqlite_offset(column, tz, start, end)
+    return func.date(column, modifier, 'weekday 0', '-6 days')
+
+
+def _sqlite_date(column, tz, start, end):
+    offset, modifier = _sqlite_offset(column, tz, start, end)
+    # Without an offset the expression matches the ix_series_user_id_date index
+    if offset == 0:
+        return func.date(column)
+    return func.date(column, modifier)
+
+
+def _postgresql_local(column, tz):
+    # Named zones are handled by the server including DST, fixed offsets are added as an interval
+    name = getattr(tz, 'key', None)
+    if name:
+        return func.timezone(name, func.timezone('UTC', column))
+    return column + func.make_interval(0, 0, 0, 0, 0, utc_offset_minutes(tz))
+
+
+def _postgresql_date(column, tz, start, end):
+    return func.date(_postgresql_local(column, tz))
+
+
+def _postgresql_week_start(column, tz, start, end):
+    return func.date(func.date_trunc('week', _postgresql_local(column, tz)))
+
+
+WEEK_START = {
+    'sqlite': _sqlite_week_start,
+    'postgresql': _postgresql_week_start
+}
+LOCAL_DATE = {
+    'sqlite': _sqlite_date,
+    'postgresql': _postgresql_date
+}
+
+
+def _as_date(value):
+    # SQLite returns dates as text
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(value)
+
+
+def _created_range(user_id, start=None):
+    # First and last creation time, the expressions only cover the offsets in between
+    query = select(func.min(Series.created_at), func.max(Series.created_at)).where(Series.user_id == user_id)
+    if start is not None:
+        query = query.where(Series.created_at >= start)
+    return db.session.execute(query).one()
+
+
+def weekly_counts(user_id, start, tz):
+    """Number of the user's series per ISO week in the given timezone since start (naive UTC).
+    Returns a dict of (iso_year, iso_week) -> count."""
+    week_start = WEEK_START.get(db.engine.dialect.name)
+    if week_start is None:
+        return _weekly_counts_python(user_id, start, tz)
+
+    first, last = _created_range(user_id, start)
+    if first is None:
+        return {}
+
+    week = week_start(Series.created_at, tz, first, last).label('week')
+    rows = db.session.execute(
+        select(week, func.count())
+        .where(Series.user_id == user_id, Series.created_at >= start)
+        .group_by(literal_column('week'))
+    ).all()
+
+    return {tuple(_as_date(monday).isocalendar()[:2]): count for monday, count in rows}
+
+
+def _weekly_counts_python(user_id, start, tz):
+    timestamps = db.session.execute(
+        select(Series.created_at).where(Series.user_id == user_id, Series.created_at >= start)
+    ).scalars()
+
+    counts = defaultdict(int)
+    for ts in timestamps:
+        counts[ts.replace(tzinfo=timezone.utc).astimezone(tz).isocalendar()[:2]] += 1
+
+    return dict(counts)
+
+
+def daily_counts(user_id, tz):
+    """Number of the user's series per local date in date order, as (date, count) tuples."""
+    local_date_of = LOCAL_DATE.get(db.engine.dialect.name)
+    if local_date_of is None:
+        return _daily_counts_python(user_id, tz)
+
+    first, last = _created_range(user_id)
+    if first is None:
+        return []
+
+    day = local_date_of(Series.created_at, tz, first, last).label('day')
+    rows = db.session.execute(
+        select(day, func.count())
+        .where(Series.user_id == user_id)
+        .group_by(literal_column('day'))
+        .order_by(literal_column('day'))
+    ).all()
+
+    return [(_as_date(day), count) for day, count in rows]
+
+
+def _daily_counts_python(user_id, tz):
+    timestamps = db.session.execute(
+        select(Series.created_at).where(Series.user_id == user_id)
+    ).scalars()
+
+    counts = defaultdict(int)
+    for ts in timestamps:
+        counts[local_date(ts, tz)] += 1
+
+    return sorted(counts.items())
@@ -1,33 +1,80 @@
-from collections import defaultdict
 from datetime import datetime, timedelta, timezone
-import threading
+from functools import lru_cache, wraps
+from zoneinfo import available_timezones
+import secrets
 import uuid
 import os
 from werkzeug.security import generate_password_hash, check_password_hash
-from sqlalchemy import func, cast, Date
+from sqlalchemy import func, cast, Date, tuple_
 from sqlalchemy.orm import joinedload
-from data_importer import import_data_from_file
-from models import db, Series, User
-from plots import weekly_series_plot, generate_target, median_points
-from metrics import compute_metrics
+from jobs import ImportQueue, QueueFull, job_status
+from models import db, Series, User, ImportJob
+from plots import target_spec
+from render import RenderPool, RenderBusy, RenderError, RenderTimeout, default_processes
+from reports import GRANULARITIES, median_points
+from aggregates import get_daily_aggregate, rebuild_daily_aggregates
+from aggregation import daily_counts, get_zone, local_date, local_zone_name, weekly_counts
+from cache import LRUCache, cached, make_result_cache, etag_for, get_data_version, get_data_stamp, bump_data_version
+from migrations import upgrade
+import shotstore
+import storage
+import instrumentation
 from flask_login import LoginManager, login_user, login_required, logout_user, current_user
-from flask import abort, session, send_file
-from flask import Flask, render_template, request, redirect, url_for, copy_current_request_context, jsonify
+from flask_socketio import SocketIO, join_room
+from flask import abort, g, session, send_file, make_response
+from flask import Flask, render_template, request, redirect, url_for, jsonify
 
 
-# TODO: timezone should be in user configuration
-def localize_timestamp(ts):
-    # Ensure the timestamp is timezone-aware UTC, then convert to local time
-    if ts.tzinfo is None:
-        ts = ts.replace(tzinfo=timezone.utc)
+def user_timezone():
+    """The current user's timezone, resolved once per request."""
+    if 'timezone' not in g:
+        name = current_user.timezone if current_user.is_authenticated else None
+        g.timezone = get_zone(name, app.config['DEFAULT_TIMEZONE'])
 
-    # FIXME: timezone is user-specific
-    return ts.astimezone()  # convert to system local timezone
+    return g.timezone
 
 
-def localize_timestamps(series):
-    for s in series:
-        s.created_at = localize_timestamp(getattr(s, "created_at"))
+def localtime(ts, fmt='%Y-%m-%d %H:%M'):
+    # Stored timestamps are naive UTC, they are only converted for display
+    return ts.replace(tzinfo=timezone.utc).astimezone(user_timezone()).strftime(fmt)
+
+
+@lru_cache(maxsize=None)
+def timezone_names():
+    return sorted(available_timezones())
+
+
+def daily_aggregate_params(aggregate):
+    # Shots are passed to the templates as the stored JSON
+    if aggregate is None or aggregate.n_shots == 0:
+        return {'shots': None, 'n_shots': 0, 'metrics': {}}
+
+    return {'shots': aggregate.shots, 'n_shots': aggregate.n_shots, 'metrics': aggregate.metrics}
+
+
+def load_secret_key(path):
+    """Read the session signing key from path, creating it on first start. All worker
+    processes must sign with the same key, the first one to start creates the file."""
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        pass
+
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as f:
+        f.write(secrets.token_hex(32))
+    try:
+        # link fails if another process created the key first, then its key is used
+        os.link(tmp, path)
+    except FileExistsError:
+        pass
+    finally:
+        os.unlink(tmp)
+
+    with open(path) as f:
+        return f.read().strip()
 
 
 def create_app():
@@ -45,14 +92,70 @@ def create_app():
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
     app.config['UPLOAD_FOLDER'] = os.path.join(basedir, 'uploads')
     app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16 MB
-    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', str(uuid.uuid4()))
+    # The key is shared by all worker processes, without SECRET_KEY it is generated once
+    # and kept in SECRET_KEY_FILE
+    app.config['SECRET_KEY_FILE'] = os.environ.get(
+        'SECRET_KEY_FILE', os.path.join(basedir, 'instance', 'secret_key'))
+    app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY') or load_secret_key(app.config['SECRET_KEY_FILE'])
+    # Number of games written per transaction by the importer
+    app.config['IMPORT_BATCH_SIZE'] = int(os.environ.get('IMPORT_BATCH_SIZE', 500))
+    # Background import workers and the number of uploads allowed to wait for them.
+    # SQLite has a single writer, more than one worker only helps with PostgreSQL.
+    app.config['IMPORT_WORKERS'] = int(os.environ.get('IMPORT_WORKERS', 1))
+    app.config['IMPORT_QUEUE_SIZE'] = int(os.environ.get('IMPORT_QUEUE_SIZE', 32))
+    # Jobs are claimed from the database by any worker process. A job whose process stops
+    # renewing its lease for this long is taken over by another one.
+    app.config['IMPORT_LEASE_SECONDS'] = int(os.environ.get('IMPORT_LEASE_SECONDS', 300))
+    app.config['IMPORT_POLL_INTERVAL'] = float(os.environ.get('IMPORT_POLL_INTERVAL', 2))
+    # Upper bound for the rendered PNG cache in bytes
+    app.config['PNG_CACHE_SIZE'] = int(os.environ.get('PNG_CACHE_SIZE', 64 * 1024 * 1024))
+    # Processes rendering the PNG plots, 0 renders in the request. At most RENDER_QUEUE_SIZE
+    # plots wait or render at a time, more are refused with 503, slower ones with 504.
+    app.config['RENDER_PROCESSES'] = int(os.environ.get('RENDER_PROCESSES', default_processes()))
+    app.config['RENDER_QUEUE_SIZE'] = int(os.environ.get(
+        'RENDER_QUEUE_SIZE', 4 * max(app.config['RENDER_PROCESSES'], 1)))
+    app.config['RENDER_TIMEOUT'] = float(os.environ.get('RENDER_TIMEOUT', 10))
+    # Directory of the columnar shot store, empty to disable it
+    app.config['SHOT_STORE_DIR'] = os.environ.get(
+        'SHOT_STORE_DIR', os.path.join(basedir, 'instance', 'shots'))
+    # Number of query results kept in the result cache
+    app.config['RESULT_CACHE_SIZE'] = int(os.environ.get('RESULT_CACHE_SIZE', 10000))
+    # 'memory' keeps results per process, 'file' shares them between the workers of a host
+    app.config['RESULT_CACHE_BACKEND'] = os.environ.get('RESULT_CACHE_BACKEND', 'memory')
+    app.config['RESULT_CACHE_DIR'] = os.environ.get(
+        'RESULT_CACHE_DIR', os.path.join(basedir, 'instance', 'cache'))
+    # Seconds a cached result is used, 0 for no limit
+    app.config['RESULT_CACHE_TTL'] = int(os.environ.get('RESULT_CACHE_TTL', 0))
+    # Request timing, JSON request logs and the Prometheus /metrics endpoint
+    app.config['METRICS_ENABLED'] = os.environ.get('METRICS_ENABLED', '1') == '1'
+    app.config['METRICS_LOG_LEVEL'] = os.environ.get('METRICS_LOG_LEVEL', 'INFO')
+    # Bearer token of the scraper, without one /metrics needs a logged in user
+    app.config['METRICS_TOKEN'] = os.environ.get('METRICS_TOKEN') or None
+    # Number of series rendered into the /results sidebar before it loads more on scroll
+    app.config['RESULTS_PAGE_SIZE'] = int(os.environ.get('RESULTS_PAGE_SIZE', 50))
+    # IANA timezone of users who have not chosen one, the server's timezone if empty
+    app.config['DEFAULT_TIMEZONE'] = os.environ.get('DEFAULT_TIMEZONE') or local_zone_name()
+    # Redis or another Kombu URL, needed to notify clients connected to other worker processes
+    app.config['SOCKETIO_MESSAGE_QUEUE'] = os.environ.get('SOCKETIO_MESSAGE_QUEUE') or None
+
+    # SQLite journal and sync settings, see storage.py for the profiles
+    app.config['STORAGE_PROFILE'] = os.environ.get('STORAGE_PROFILE', 'balanced')
+    app.config['DB_POOL_SIZE'] = int(os.environ.get('DB_POOL_SIZE', 10))
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = storage.engine_options(app.config)
 
     # Initialize the Flask-SQLAlchemy extension
     db.init_app(app)
+    storage.init_app(app)
+    shotstore.init_app(app)
+    instrumentation.init_app(app)
 
-    with app.app_context():
+    # Worker processes start together, one at a time creates and upgrades the tables
+    os.makedirs(os.path.dirname(app.config['SECRET_KEY_FILE']), exist_ok=True)
+    with storage.file_lock(app.config['SECRET_KEY_FILE'] + '.lock'), app.app_context():
         # Create the database tables if they don't exist
         db.create_all()
+        # Bring tables created by earlier versions up to date
+        upgrade(db.engine)
 
     return app
 
@@ -61,6 +164,106 @@ app = create_app()
 login_manager = LoginManager()
 login_manager.init_app(app)
 login_manager.login_view = 'login'
+app.add_template_filter(localtime)
+socketio = SocketIO(app, message_queue=app.config['SOCKETIO_MESSAGE_QUEUE'])
+
+
+def notify_import(user_id, status):
+    socketio.emit('import', status, to=f'user-{user_id}')
+
+
+import_queue = ImportQueue(app, notify=notify_import)
+png_cache = LRUCache(app.config['PNG_CACHE_SIZE'])
+render_pool = RenderPool(app)
+result_cache = make_result_cache(app.config)
+
+
+def series_count(user_id):
+    # Only changes when the user's data does
+    return cached(
+        result_cache, ('series_count', user_id, get_data_version(user_id)),
+        lambda: db.session.query(func.count(Series.id)).filter(Series.user_id == user_id).scalar())
+
+
+def send_cached_png(key, render):
+    """Send a PNG from the cache, rendering it on a miss. Conditional requests
+    are answered before anything is looked up or rendered."""
+    etag = etag_for(key)
+    if etag in request.if_none_match:
+        response = make_response('', 304)
+    else:
+        png = png_cache.get(key)
+        if png is None:
+            png = render()
+            png_cache.set(key, png)
+        response = make_response(png)
+        response.mimetype = 'image/png'
+
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+
+    return response
+
+
+@app.errorhandler(RenderBusy)
+def render_busy(e):
+    return 'Too many plots are being rendered, try again later', 503, {'Retry-After': '1'}
+
+
+@app.errorhandler(RenderTimeout)
+def render_timeout(e):
+    return str(e), 504
+
+
+@app.errorhandler(RenderError)
+def render_error(e):
+    print(f"Rendering failed: {e}")
+    return 'The plot could not be rendered', 500
+
+
+def conditional(view):
+    """Validate responses of a per-user view by the user's data version.
+
+    Conditional requests are answered with 304 before the view runs, so the
+    response may only depend on the URL, the user's data and timezone.
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        version, updated_at = get_data_stamp(current_user.id)
+        etag = etag_for(('view', current_user.id, request.full_path, str(user_timezone()), version))
+        last_modified = updated_at.replace(tzinfo=timezone.utc, microsecond=0) if updated_at else None
+
+        # If-None-Match takes precedence over If-Modified-Since
+        if request.if_none_match:
+            not_modified = etag in request.if_none_match
+        else:
+            not_modified = bool(last_modified and request.if_modified_since
+                                and last_modified <= request.if_modified_since)
+
+        if not_modified:
+            response = make_response('', 304)
+        else:
+            response = make_response(view(*args, **kwargs))
+            if response.status_code != 200:
+                return response
+
+        response.set_etag(etag)
+        if last_modified:
+            response.last_modified = last_modified
+        response.headers['Cache-Control'] = 'private, no-cache'
+
+        return response
+
+    return wrapper
+
+
+@socketio.on('connect')
+def socket_connect():
+    if not current_user.is_authenticated:
+        return False
+
+    # Each user has a private room for import notifications
+    join_room(f'user-{current_user.id}')
 
 
 @app.route('/')
@@ -71,58 +274,86 @@ def index():
 
 @app.route('/data/heatmap', methods=['GET'])
 @login_required
+@conditional
 def get_heatmap_data():
-    series = (
-        db.session.query(Series)
-        .filter(Series.user_id == current_user.id)
-        .order_by(Series.created_at.asc())
-        .with_entities(
-            func.date(Series.created_at).label('date'),
-            func.count(Series.id).label('value')
-        ).group_by(func.date(Series.created_at)).order_by(func.date(Series.created_at).asc())
-        .all()
-    )
+    key = ('heatmap', current_user.id, str(user_timezone()), get_data_version(current_user.id))
+    data = cached(result_cache, key, lambda: heatmap_counts(current_user.id, user_timezone()))
 
-    if not series:
+    if not data:
         abort(404, description='No series found')
 
-    return jsonify([{'date': str(row.date), 'value': row.value} for row in series])
+    return jsonify(data)
+
+
+def heatmap_counts(user_id, tz):
+    # Days are the user's local dates
+    return [{'date': day.isoformat(), 'value': count} for day, count in daily_counts(user_id, tz)]
+
+
+# Largest page of /data/series
+MAX_SERIES_LIMIT = 1000
+
+
+def encode_cursor(created_at, series_id):
+    return f"{created_at.strftime('%Y-%m-%dT%H:%M:%S')}_{series_id}"
+
+
+def decode_cursor(cursor):
+    created_at, series_id = cursor.split('_')
+    return datetime.strptime(created_at, '%Y-%m-%dT%H:%M:%S'), int(series_id)
 
 
 @app.route('/data/series', methods=['GET'])
 @login_required
+@conditional
 def data_series():
-    page = request.args.get('page', 1, type=int)
-    limit = request.args.get('limit', 100, type=int)
-    offset = (page - 1) * limit
+    """Series of the user, newest first.
 
-    # Get total count
-    total = db.session.query(func.count(Series.id)).filter(
-        Series.user_id == current_user.id).scalar()
-
-    # Get paginated results
-    series = (
-        db.session.query(Series)
-        .options(joinedload(Series.metric))
+    Without a page parameter the listing is paginated by the (created_at, id) keyset:
+    pass the nextCursor of a response as the after parameter to get the next page.
+    """
+    limit = request.args.get('limit', 100, type=int)
+    if limit < 1:
+        abort(400, description='Invalid limit')
+    limit = min(limit, MAX_SERIES_LIMIT)
+    total = series_count(current_user.id)
+
+    query = (
+        db.session.query(Series.id, Series.created_at, Series.description,
+                         Series.total_points, Series.total_t, Series.consistency_pct)
         .filter(Series.user_id == current_user.id)
-        .order_by(Series.created_at.desc())
-        .offset(offset)
-        .limit(limit)
-        .all()
+        .order_by(Series.created_at.desc(), Series.id.desc())
     )
 
-    if not series and total > 0:
+    if 'page' in request.args:
+        page = request.args.get('page', 1, type=int)
+        query = query.offset((page - 1) * limit)
+    elif request.args.get('after'):
+        try:
+            created_at, series_id = decode_cursor(request.args['after'])
+        except ValueError:
+            abort(400, description='Invalid cursor')
+        query = query.filter(tuple_(Series.created_at, Series.id) < (created_at, series_id))
+
+    series = query.limit(limit).all()
+
+    if not series and total > 0 and 'page' in request.args:
         abort(404, description='Page not found')
 
+    next_cursor = None
+    if len(series) == limit:
+        next_cursor = encode_cursor(series[-1].created_at, series[-1].id)
+
     return jsonify({
         'totalItems': total,
+        'nextCursor': next_cursor,
         'items': [{
             'id': s.id,
-            'created_at': localize_timestamp(s.created_at).strftime('%Y-%m-%d %H:%M'),
+            'created_at': localtime(s.created_at),
             'description': s.description,
             'total_points': round(s.total_points, 1),
             'total_t': round(s.total_t, 1),
-            'consistency': round(next((m.value for m in s.metric if m.name == 'ConsistencyPct'), 0), 1)
+            'consistency': round(s.consistency_pct or 0, 1)
         } for s in series]})
 
 
@@ -135,10 +366,6 @@ def get_series():
 @app.route('/upload', methods=['GET', 'POST'])
 @login_required
 def upload_file():
-    @copy_current_request_context
-    def import_data_from_file_wrapper(filename, user_id):
-        import_data_from_file(filename, user_id)
-
     if request.method == "POST":
         if 'file' not in request.files:
             return 'No file part in the request', 400
@@ -150,48 +377,70 @@ def upload_file():
 
         filename = os.path.join(app.config['UPLOAD_FOLDER'], str(uuid.uuid4()))
         file.save(filename)
-        thread = threading.Thread(
-            target=import_data_from_file_wrapper, args=(filename, current_user.id))
-        thread.start()
+
+        try:
+            import_queue.submit(filename, current_user.id)
+        except QueueFull:
+            os.unlink(filename)
+            return 'Too many imports in progress, try again later', 503
 
         return redirect(url_for('dashboard'))
 
     return render_template('upload.html')
 
 
+@app.route('/data/import/<int:job_id>')
+@login_required
+def data_import_job(job_id):
+    job = (
+        db.session.query(ImportJob)
+        .filter(ImportJob.id == job_id, ImportJob.user_id == current_user.id)
+        .first()
+    )
+
+    if not job:
+        abort(404, description='Import job not found')
+
+    return jsonify(job_status(job))
+
+
 @app.route('/report/series/weekly_count')
 @login_required
 def report_series_weekly_count():
     return render_template('report_series_weekly_count.html')
 
 
-# TODO: choose the right metric and time aggregation
+# TODO: choose the right metric
 @app.route('/report/series/median_points', methods=['GET'])
 @login_required
 def report_series_median_points():
-    series = (
-        db.session.query(Series)
-        .options(joinedload(Series.shot))
-        .filter(Series.user_id == current_user.id)
-        .order_by(Series.created_at.asc())
-        .all()
-    )
-
-    if not series:
+    granularity = request.args.get('granularity', 'series')
+    if granularity not in GRANULARITIES:
+        abort(400, description='Invalid granularity')
+
+    since = request.args.get('since')
+    try:
+        since = datetime.strptime(since, '%Y-%m-%d').date() if since else None
+    except ValueError:
+        abort(400, description='Invalid date')
+
+    # The buckets only change when the user's data or timezone does
+    tz = user_timezone()
+    key = ('median_points', current_user.id, str(tz), granularity, since, get_data_version(current_user.id))
+    data = cached(result_cache, key, lambda: median_points(current_user.id, tz, granularity, since))
+
+    if not data:
         abort(404, description='No series found')
 
-    return render_template("report_series_median_points.html", data=median_points(series))
+    return render_template("report_series_median_points.html",
+                           labels=[label for label, _ in data],
+                           data=[value for _, value in data],
+                           granularity=granularity,
+                           granularities=GRANULARITIES,
+                           since=request.args.get('since', ''))
 
 
-# It is unfeasible to do this in database-agnostic way, therefore most part is done with Python.
-@app.route('/data/series/weekly_count')
-@login_required
-def data_series_weekly_count():
-    end_date = localize_timestamp(datetime.utcnow())
-    start_date = end_date - timedelta(weeks=52)
-
-    # Start from the Monday of the first week
-    start_monday = start_date - timedelta(days=start_date.weekday())
+def weekly_series_counts(user_id, start_monday, end_date):
     all_weeks = []
     current = start_monday
 
@@ -200,26 +449,11 @@ def data_series_weekly_count():
         all_weeks.append((iso_year, iso_week))
         current += timedelta(weeks=1)
 
-    # Query timestamps
-    # Convert the local start_monday back to UTC for querying the DB (DB timestamps are in UTC)
-    start_monday_utc = start_monday.astimezone(timezone.utc)
-    # TODO: If the DB stores tz-aware datetimes, pass start_monday_utc instead.
-    start_monday_for_query = start_monday_utc.replace(tzinfo=None)
-
-    timestamps = (
-        db.session.query(Series.created_at)
-        .filter(Series.created_at >= start_monday_for_query, Series.user_id == current_user.id)
-        .all()
-    )
+    # Convert the local start_monday back to UTC for querying the DB (DB timestamps are naive UTC)
+    start_monday_utc = start_monday.astimezone(timezone.utc).replace(tzinfo=None)
+    actual_counts = weekly_counts(user_id, start_monday_utc, start_monday.tzinfo)
 
-    # Count by ISO week
-    actual_counts = defaultdict(int)
-    # Iterate over dates
-    for dt in [localize_timestamp(ts[0]) for ts in timestamps]:
-        year_week = dt.isocalendar()[:2]
-        actual_counts[year_week] += 1
-
-    formatted = [
+    return [
         {
             'week': f'{year}-W{week:02d}',
             'count': actual_counts.get((year, week), 0)
@@ -227,61 +461,75 @@ def data_series_weekly_count():
         for (year, week) in all_weeks
     ]
 
-    return send_file(weekly_series_plot(formatted), mimetype='image/png')
+
+@app.route('/data/series/weekly_count')
+@login_required
+def data_series_weekly_count():
+    end_date = datetime.now(user_timezone())
+    start_date = end_date - timedelta(weeks=52)
+
+    # Start from the Monday of the first week
+    start_monday = (start_date - timedelta(days=start_date.weekday())).replace(
+        hour=0, minute=0, second=0, microsecond=0)
+
+    # The counts only change with the week window, the timezone and the user's data
+    key = ('weekly_count', current_user.id, start_monday.date(), str(user_timezone()),
+           get_data_version(current_user.id))
+    counts = cached(result_cache, key, lambda: weekly_series_counts(current_user.id, start_monday, end_date))
+
+    if request.args.get('format') == 'json':
+        return jsonify(counts)
+
+    return send_cached_png(key, lambda: render_pool.render('weekly', counts))
 
 
 # TODO: fragment (?)
 @app.route('/report/series/latest_date')
 @login_required
 def report_series_latest_date():
-    latest_date = (
+    latest = (
         db.session.query(func.max(Series.created_at))
         .filter(Series.user_id == current_user.id)
         .scalar()
-    ).date()
-    # TODO: this could be SQLite specific (?)
-    series = (
-        db.session.query(Series)
-        .options(joinedload(Series.shot), joinedload(Series.metric))
-        .filter(
-            func.date(Series.created_at) == latest_date,
-            Series.user_id == current_user.id
-        )
-        .all()
     )
 
-    shots = [[shot.x, shot.y] for s in series for shot in s.shot]
-    metrics = compute_metrics(shots)
+    if latest is None:
+        abort(404, description='No series found')
+
+    latest_date = local_date(latest, user_timezone())
+    aggregate = get_daily_aggregate(current_user.id, latest_date, user_timezone())
 
-    return render_template('latest_date.html', date=latest_date, shots=shots, metrics=metrics)
+    return render_template('latest_date.html', date=latest_date, **daily_aggregate_params(aggregate))
 
 
 @app.route('/fragment/multiseries/<date>')
 @login_required
+@conditional
 def fragment_multiseries_date(date):
-    # TODO: this could be SQLite specific (?)
-    series = (
-        db.session.query(Series)
-        .options(joinedload(Series.shot), joinedload(Series.metric))
-        .filter(
-            func.date(Series.created_at) == date,
-            Series.user_id == current_user.id
-        )
-        .all()
-    )
+    try:
+        day = datetime.strptime(date, '%Y-%m-%d').date()
+    except ValueError:
+        abort(404, description='Invalid date')
 
-    shots = [[shot.x, shot.y] for s in series for shot in s.shot]
-    metrics = compute_metrics(shots)
+    aggregate = get_daily_aggregate(current_user.id, day, user_timezone())
 
-    return render_template('fragments/multiseries.html', date=date, shots=shots, metrics=metrics)
+    return render_template('fragments/multiseries.html', date=date, **daily_aggregate_params(aggregate))
 
 
 @app.route('/target/<int:series_id>')
 @login_required
 def target(series_id):
+    # For downloads, the pages draw the target in the browser from /data/target.
+    # Series are immutable, the image only depends on the series and the displayed timezone
+    return send_cached_png(('target', current_user.id, series_id, str(user_timezone())),
+                           lambda: render_target(series_id))
+
+
+def user_series(series_id):
+    """A series of the current user with its shots, 404 if there is none."""
     series = (
         db.session.query(Series)
-        .options(joinedload(Series.shot), joinedload(Series.metric))
+        .options(joinedload(Series.shot))
         .filter(Series.id == series_id, Series.user_id == current_user.id)
         .first()
     )
@@ -289,36 +537,69 @@ def target(series_id):
     if not series:
         abort(404, description='Series not found')
 
-    localize_timestamps([series])
+    return series
+
+
+def render_target(series_id):
+    return render_pool.render('target', target_spec(user_series(series_id), tz=user_timezone()))
+
+
+def target_data(series):
+    """Everything the browser needs to draw a series with create_series_plot."""
+    return {
+        'id': series.id,
+        'description': series.description,
+        'created_at': localtime(series.created_at),
+        'total_points': round(series.total_points, 1),
+        'total_t': round(series.total_t, 1) if series.total_t is not None else None,
+        'n': series.n,
+        'mpi_x': series.mpi_x,
+        'mpi_y': series.mpi_y,
+        'metrics': series.metrics,
+        'shots': [{
+            'shotnum': shot.shotnum,
+            'points': shot.points,
+            'hit': shot.hit,
+            'x': shot.x,
+            'y': shot.y,
+            't': shot.t
+        } for shot in series.shot]
+    }
+
 
-    return send_file(generate_target(series), mimetype='image/png')
+@app.route('/data/target/<int:series_id>')
+@login_required
+@conditional
+def data_target(series_id):
+    return jsonify(target_data(user_series(series_id)))
 
 
 @app.route('/fragment/target/<int:series_id>')
 @login_required
+@conditional
 def fragment_target(series_id):
-    series = (
-        db.session.query(Series)
-        .options(joinedload(Series.shot), joinedload(Series.metric))
-        .filter(Series.id == series_id, Series.user_id == current_user.id)
-        .first()
-    )
-
-    if not series:
-        abort(404, description='Series not found')
+    return render_template('fragments/target.html', target=target_data(user_series(series_id)))
 
-    localize_timestamps([series])
 
-    return render_template('fragments/target.html', series=series)
+@app.route('/series/<int:series_id>')
+@login_required
+@conditional
+def series_page(series_id):
+    return render_template('target.html', target=target_data(user_series(series_id)))
 
 
 @app.route("/dashboard")
 @login_required
 def dashboard():
-    series_count = db.session.query(
-        func.count(Series.id)).filter(Series.user_id == current_user.id).scalar()
+    jobs = (
+        db.session.query(ImportJob)
+        .filter(ImportJob.user_id == current_user.id, ImportJob.status.in_(('queued', 'running')))
+        .order_by(ImportJob.id.asc())
+        .all()
+    )
     params = {
-        "series_count": series_count
+        "series_count": series_count(current_user.id),
+        "import_jobs": [job_status(job) for job in jobs]
     }
 
     return render_template("dashboard.html", params=params)
@@ -327,18 +608,43 @@ def dashboard():
 @app.route('/results')
 @login_required
 def results():
+    # Only the first page of the sidebar is rendered, the page loads the rest from /data/series
+    limit = app.config['RESULTS_PAGE_SIZE']
     series = (
-        db.session.query(Series)
+        db.session.query(Series.id, Series.created_at, Series.description,
+                         Series.total_points, Series.total_t)
         .filter(Series.user_id == current_user.id)
-        .options(joinedload(Series.metric))
-        .order_by(Series.created_at.desc())
-        .limit(1000)
+        .order_by(Series.created_at.desc(), Series.id.desc())
+        .limit(limit)
         .all()
     )
 
-    localize_timestamps(series)
+    next_cursor = None
+    if len(series) == limit:
+        next_cursor = encode_cursor(series[-1].created_at, series[-1].id)
+
+    return render_template('results.html', series=series, next_cursor=next_cursor)
 
-    return render_template('results.html', series=series)
+
+@app.route('/settings', methods=['GET', 'POST'])
+@login_required
+def settings():
+    if request.method == 'POST':
+        name = request.form.get('timezone') or None
+        if name is not None and name not in timezone_names():
+            return render_template('settings.html', timezones=timezone_names(), error='Unknown timezone!')
+
+        if name != current_user.timezone:
+            current_user.timezone = name
+            g.pop('timezone', None)
+            # Daily aggregates, cached reports and images depend on the timezone
+            rebuild_daily_aggregates(current_user.id, user_timezone())
+            bump_data_version(current_user.id)
+            db.session.commit()
+
+        return render_template('settings.html', timezones=timezone_names(), message='Settings saved')
+
+    return render_template('settings.html', timezones=timezone_names())
 
 
 # Load user for Flask-Login
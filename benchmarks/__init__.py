@@ -0,0 +1,6 @@
+"""Synthetic data and timing runs for comparing performance between commits.
+
+    python -m benchmarks.generate /tmp/ecoaims.db --games 50000
+    python -m benchmarks.run --games 5000 --output bench.json
+    python -m benchmarks.explain
+"""
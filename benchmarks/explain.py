@@ -0,0 +1,127 @@
+"""Check that the queries of the main routes use indexes.
+
+Runs the routes against a small synthetic history on SQLite, records their
+SELECT statements and prints the EXPLAIN QUERY PLAN of each. Exits with status 1
+if a plan scans a table without an index or a route does not use the index it
+is expected to.
+
+    python -m benchmarks.explain
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+
+from benchmarks.run import configure
+
+# Tables whose full scan is a regression
+TABLES = ('series', 'shot', 'daily_aggregate')
+
+# Index each route must use, with the timezone of the user
+EXPECTED = [
+    ('/data/heatmap', None, 'ix_series_user_id_date'),
+    ('/data/heatmap', 'Europe/Helsinki', 'ux_series_user_id_created_at'),
+    ('/data/series?limit=100', None, 'ux_series_user_id_created_at'),
+    ('/fragment/multiseries/{day}', None, 'ux_series_user_id_created_at'),
+    ('/fragment/multiseries/{day}', 'Europe/Helsinki', 'ux_series_user_id_created_at'),
+    ('/report/series/latest_date', 'Europe/Helsinki', 'ux_series_user_id_created_at'),
+    ('/data/series/weekly_count?format=json', 'Europe/Helsinki', 'ux_series_user_id_created_at'),
+    ('/results', None, 'ux_series_user_id_created_at'),
+]
+
+
+def full_scans(plan):
+    return [detail for detail in plan
+            if detail.startswith('SCAN') and 'INDEX' not in detail
+            and detail.split()[1] in TABLES]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check the query plans of the main routes.')
+    parser.add_argument('--games', type=int, default=500)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        configure(workdir)
+        return check(workdir, args.games)
+
+
+def check(workdir, games):
+    from sqlalchemy import event, text
+    from benchmarks.generate import generate_ecoaims_db
+    from app import app
+    from models import db, DailyAggregate, Series, User
+    from data_importer import import_ecoaims_db
+
+    ecoaims_db = os.path.join(workdir, 'ecoaims.db')
+    generate_ecoaims_db(ecoaims_db, games)
+
+    client = app.test_client()
+    client.post('/signup', data={'username': 'explain', 'password': 'explain'})
+    client.post('/login', data={'username': 'explain', 'password': 'explain'})
+
+    with app.app_context():
+        user_id = User.query.filter_by(username='explain').first().id
+        with contextlib.redirect_stdout(io.StringIO()):
+            import_ecoaims_db(ecoaims_db, user_id)
+        # Statistics make the planner choose as it would on a real database
+        db.session.execute(text('ANALYZE'))
+        db.session.commit()
+        day = db.session.query(Series.created_at).order_by(Series.id.desc()).first()[0].strftime('%Y-%m-%d')
+
+    statements = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith('SELECT') and not executemany:
+            statements.append((statement, parameters))
+
+    failed = False
+    for url, timezone, index in EXPECTED:
+        with app.app_context():
+            db.session.get(User, user_id).timezone = timezone
+            # Check the queries that build the daily aggregates on first use
+            db.session.query(DailyAggregate).filter(DailyAggregate.user_id == user_id).delete()
+            db.session.commit()
+            engine = db.engine
+
+        # Requests run outside of an app context, so that each gets its own session and g
+        statements.clear()
+        event.listen(engine, 'before_cursor_execute', record)
+        try:
+            response = client.get(url.format(day=day))
+        finally:
+            event.remove(engine, 'before_cursor_execute', record)
+
+        print(f'GET {url.format(day=day)} (timezone {timezone or "server"}): {response.status_code}')
+        used = False
+        with app.app_context():
+            for statement, parameters in statements:
+                if not any(table in statement for table in TABLES):
+                    continue
+
+                plan = [row[-1] for row in db.session.connection().exec_driver_sql(
+                    'EXPLAIN QUERY PLAN ' + statement, parameters)]
+                used = used or any(index in detail for detail in plan)
+                scans = full_scans(plan)
+                print('    ' + ' '.join(statement.split())[:120])
+                for detail in plan:
+                    print(f'        {detail}')
+                if scans:
+                    failed = True
+                    print(f'    FAIL: full scan {scans}')
+
+        if response.status_code != 200:
+            failed = True
+            print(f'    FAIL: status {response.status_code}')
+        if not used:
+            failed = True
+            print(f'    FAIL: {index} not used')
+
+    print('FAILED' if failed else 'OK')
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,91 @@
+"""Generate a synthetic Ecoaims database of shooting history."""
+import argparse
+import json
+import math
+import random
+import sqlite3
+from datetime import datetime, timedelta
+from plots import TARGET_CENTER
+
+# Target center in Ecoaims device coordinates, which the importer moves by (-20, +10)
+# onto plots.TARGET_CENTER (see data_importer.transform_coordinates), and pixels per mm
+CENTER = (TARGET_CENTER[0] + 20, TARGET_CENTER[1] - 10)
+PX_PER_MM = 2.2
+
+
+def score(dx, dy):
+    # Decimal scoring, 10.9 in the middle and one point per 8 mm ring
+    r_mm = math.hypot(dx, dy) / PX_PER_MM
+    return round(min(10.9, max(0.0, 11.0 - r_mm / 8.0)), 1)
+
+
+def make_game(rng, shots_per_game, bias, sigma):
+    shots = []
+    t = 0.0
+    for k in range(shots_per_game):
+        # Normal scatter around the session's point of impact, with an occasional flyer
+        spread = sigma * (3 if rng.random() < 0.03 else 1)
+        dx = bias[0] + rng.gauss(0, spread)
+        dy = bias[1] + rng.gauss(0, spread)
+        t += rng.uniform(4, 20)
+        points = score(dx, dy)
+        shots.append({"shot": {
+            "x": int(CENTER[0] + dx),
+            "y": int(CENTER[1] + dy),
+            "points": points,
+            "time": round(t, 1),
+            "shotNumber": k + 1,
+            "hit": int(points > 0)
+        }})
+
+    # The last element of a finished game has no shot
+    shots.append({"shot": False})
+    return {"series": [{"shots": shots}]}
+
+
+def generate_ecoaims_db(path, games=50000, shots_per_game=10, seed=1, end=None):
+    """Write games into the ekoaims_games table of an SQLite file.
+
+    Games come in training sessions of several games, most days have one,
+    and the history ends at end (default now).
+    """
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path)
+    conn.execute("""CREATE TABLE IF NOT EXISTS ekoaims_games (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        game TEXT NOT NULL,
+        settings TEXT NOT NULL,
+        created TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )""")
+
+    settings = json.dumps({"target": "issf_10m_air_pistol"})
+    day = (end or datetime.now()).replace(hour=0, minute=0, second=0, microsecond=0)
+    skill = 12.0  # Group size in pixels, worse further back in time
+    rows = []
+    while len(rows) < games:
+        # Sessions are generated backwards in time from the end
+        day -= timedelta(days=rng.choice((1, 1, 1, 1, 2, 3)))
+        skill = min(40.0, skill * rng.uniform(1.0, 1.002))
+        bias = (rng.gauss(0, skill / 2), rng.gauss(0, skill / 2))
+        at = day + timedelta(hours=rng.randint(7, 19), minutes=rng.randint(0, 59))
+        for _ in range(min(rng.randint(5, 30), games - len(rows))):
+            at += timedelta(minutes=rng.randint(3, 15), seconds=rng.randint(0, 59))
+            game = make_game(rng, shots_per_game, bias, skill * rng.uniform(0.8, 1.2))
+            rows.append((at.strftime('%Y-%m-%d %H:%M:%S'), json.dumps(game)))
+
+    rows.sort()
+    conn.executemany("INSERT INTO ekoaims_games (game, settings, created) VALUES (?, ?, ?)",
+                     ((game, settings, created) for created, game in rows))
+    conn.commit()
+    conn.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Generate a synthetic Ecoaims database.')
+    parser.add_argument('path', help='SQLite file to write')
+    parser.add_argument('--games', type=int, default=50000)
+    parser.add_argument('--shots', type=int, default=10, help='Shots per game')
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    generate_ecoaims_db(args.path, args.games, args.shots, args.seed)
@@ -0,0 +1,156 @@
+"""Time the importer, metrics, plots and the main routes on synthetic data.
+
+Everything runs against a fresh database in a temporary directory. Results are
+written as JSON, compare two runs to spot regressions between commits.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def measure(function, repeat):
+    """Call function repeat times, returns timing statistics in milliseconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append((time.perf_counter() - start) * 1000)
+
+    return {
+        'repeat': repeat,
+        'min_ms': round(min(times), 3),
+        'median_ms': round(statistics.median(times), 3),
+        'mean_ms': round(statistics.mean(times), 3),
+        'max_ms': round(max(times), 3)
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def configure(workdir):
+    # The app reads its configuration on import
+    os.environ['DATABASE_URI'] = 'sqlite:///' + os.path.join(workdir, 'app.db')
+    os.environ['SHOT_STORE_DIR'] = os.path.join(workdir, 'shots')
+    os.environ['RESULT_CACHE_DIR'] = os.path.join(workdir, 'cache')
+    os.environ['SECRET_KEY_FILE'] = os.path.join(workdir, 'secret_key')
+    os.environ.setdefault('METRICS_LOG_LEVEL', 'WARNING')
+    sys.path.insert(0, ROOT)
+
+
+def run(games, repeat, workdir):
+    configure(workdir)
+
+    import numpy as np
+    from benchmarks.generate import generate_ecoaims_db
+    from app import app
+    from models import db, Series, User
+    from data_importer import import_ecoaims_db
+    from metrics import compute_metrics, compute_metrics_batch
+    from plots import generate_target, weekly_series_plot
+
+    results = {}
+
+    ecoaims_db = os.path.join(workdir, 'ecoaims.db')
+    start = time.perf_counter()
+    generate_ecoaims_db(ecoaims_db, games)
+    results['generate'] = {'games': games, 'ms': round((time.perf_counter() - start) * 1000, 3)}
+
+    client = app.test_client()
+    client.post('/signup', data={'username': 'bench', 'password': 'bench'})
+    client.post('/login', data={'username': 'bench', 'password': 'bench'})
+
+    with app.app_context():
+        user_id = User.query.filter_by(username='bench').first().id
+
+        stats = import_ecoaims_db(ecoaims_db, user_id)
+        results['import_ecoaims_db'] = {
+            key: round(value, 3) if isinstance(value, float) else value for key, value in stats.items()}
+
+        rng = np.random.default_rng(1)
+        small = rng.normal(0, 20, (10, 2))
+        large = rng.normal(0, 20, (10000, 2))
+        batch = rng.normal(0, 20, (10 * 1000, 2))
+        results['compute_metrics_10'] = measure(lambda: compute_metrics(small), repeat * 10)
+        results['compute_metrics_10000'] = measure(lambda: compute_metrics(large), repeat)
+        results['compute_metrics_batch_1000x10'] = measure(
+            lambda: compute_metrics_batch(batch, [10] * 1000), repeat)
+
+        series = db.session.query(Series).filter(Series.user_id == user_id).order_by(Series.id.desc()).first()
+        results['generate_target'] = measure(lambda: generate_target(series), repeat)
+
+        weeks = [{'week': f'2024-W{week:02d}', 'count': week % 7} for week in range(1, 53)]
+        results['weekly_series_plot'] = measure(lambda: weekly_series_plot(weeks), repeat)
+
+        series_id = series.id
+        day = series.created_at.strftime('%Y-%m-%d')
+
+    routes = [
+        '/dashboard',
+        '/data/heatmap',
+        '/data/series?limit=100',
+        '/results',
+        f'/target/{series_id}',
+        f'/data/target/{series_id}',
+        f'/fragment/target/{series_id}',
+        f'/fragment/multiseries/{day}',
+        '/data/series/weekly_count',
+        '/data/series/weekly_count?format=json',
+        '/report/series/latest_date',
+        '/report/series/median_points',
+        '/report/series/median_points?granularity=week',
+    ]
+    for url in routes:
+        def get(url=url):
+            response = client.get(url)
+            if response.status_code != 200:
+                raise RuntimeError(f'{url} returned {response.status_code}')
+
+        # The first request fills the caches
+        results[f'GET {url}'] = {'cold': measure(get, 1), 'warm': measure(get, repeat)}
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the benchmarks and write the results as JSON.')
+    parser.add_argument('--games', type=int, default=5000, help='Number of synthetic games to import')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--output', default='-', help='JSON file, - for stdout')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        results = run(args.games, args.repeat, workdir)
+
+    report = {
+        'commit': git_commit(),
+        'date': datetime.utcnow().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'games': args.games,
+        'results': results
+    }
+
+    text = json.dumps(report, indent=2)
+    if args.output == '-':
+        print(text)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,212 @@
+import hashlib
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from datetime import datetime
+from sqlalchemy import insert, select, update
+from models import db, DataVersion
+
+# All caches in this process, for invalidation
+_caches = weakref.WeakSet()
+
+
+class LRUCache:
+    """Thread-safe LRU cache bounded by the total size of its values.
+
+    Keys are tuples of the form (kind, user_id, ...), so that all entries of a
+    user can be dropped when the user's data changes. Entries older than ttl
+    seconds are treated as missing.
+    """
+
+    def __init__(self, max_size, sizeof=len, ttl=None):
+        self.max_size = max_size
+        self.sizeof = sizeof
+        self.ttl = ttl
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        _caches.add(self)
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            value, expires = entry
+            if expires is not None and expires < time.monotonic():
+                self.size -= self.sizeof(self._entries.pop(key)[0])
+                return None
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        size = self.sizeof(value)
+        if size > self.max_size:
+            return
+
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        with self._lock:
+            if key in self._entries:
+                self.size -= self.sizeof(self._entries.pop(key)[0])
+            self._entries[key] = (value, expires)
+            self.size += size
+            while self.size > self.max_size:
+                _, (evicted, _) = self._entries.popitem(last=False)
+                self.size -= self.sizeof(evicted)
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            for key in [key for key in self._entries if key[1] == user_id]:
+                self.size -= self.sizeof(self._entries.pop(key)[0])
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class FileCache:
+    """Cache of pickled values in a directory, shared by all worker processes on a host.
+
+    Entries live in a directory per user so that a user's entries can be dropped
+    at once. Expiry uses the file modification time, the oldest entries are
+    removed when there are more than max_entries.
+    """
+
+    def __init__(self, directory, max_entries=10000, ttl=None):
+        self.directory = directory
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._writes = 0
+        os.makedirs(directory, exist_ok=True)
+        _caches.add(self)
+
+    def _path(self, key):
+        return os.path.join(self.directory, str(key[1]), etag_for(key))
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            if self.ttl and os.path.getmtime(path) + self.ttl < time.time():
+                return None
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+
+    def set(self, key, value):
+        path = self._path(key)
+        tmp = None
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+
+            # Write and rename, readers in other processes never see a partial entry
+            fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        except OSError:
+            # invalidate_user removed the directory meanwhile, the entry is just not cached
+            if tmp is not None:
+                try:
+                    os.remove(tmp)
+                except OSError:
+                    pass
+            return
+
+        # Trimming lists the whole directory, only do it every now and then
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self.trim()
+
+    def _files(self):
+        for entry in os.scandir(self.directory):
+            if not entry.is_dir():
+                continue
+            try:
+                yield from [file.path for file in os.scandir(entry.path) if file.is_file()]
+            except FileNotFoundError:
+                pass  # Invalidated meanwhile
+
+    def trim(self):
+        files = []
+        for path in self._files():
+            try:
+                files.append((os.path.getmtime(path), path))
+            except OSError:
+                pass
+
+        files.sort()
+        for _, path in files[:max(0, len(files) - self.max_entries)]:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def invalidate_user(self, user_id):
+        shutil.rmtree(os.path.join(self.directory, str(user_id)), ignore_errors=True)
+
+    def __len__(self):
+        return sum(1 for _ in self._files())
+
+
+def make_result_cache(config):
+    """Result cache configured by RESULT_CACHE_BACKEND ('memory' or 'file')."""
+    backend = config.get('RESULT_CACHE_BACKEND', 'memory')
+    ttl = config.get('RESULT_CACHE_TTL') or None
+    if backend == 'memory':
+        return LRUCache(config['RESULT_CACHE_SIZE'], sizeof=lambda value: 1, ttl=ttl)
+    if backend == 'file':
+        return FileCache(config['RESULT_CACHE_DIR'], max_entries=config['RESULT_CACHE_SIZE'], ttl=ttl)
+
+    raise ValueError(f"Unknown result cache backend {backend}")
+
+
+def cached(cache, key, compute):
+    """Return the cached value of key, computing and storing it on a miss."""
+    value = cache.get(key)
+    if value is None:
+        value = compute()
+        cache.set(key, value)
+
+    return value
+
+
+def etag_for(key):
+    """Strong ETag derived from a cache key, known before anything is rendered."""
+    return hashlib.sha1(repr(key).encode()).hexdigest()
+
+
+def get_data_version(user_id):
+    return db.session.execute(
+        select(DataVersion.version).where(DataVersion.user_id == user_id)
+    ).scalar() or 0
+
+
+def get_data_stamp(user_id):
+    """Return the user's data version and the time it last changed (None if never)."""
+    row = db.session.execute(
+        select(DataVersion.version, DataVersion.updated_at).where(DataVersion.user_id == user_id)
+    ).first()
+    return (row.version, row.updated_at) if row else (0, None)
+
+
+def bump_data_version(user_id):
+    """Mark the user's data as changed. The caller owns the transaction."""
+    now = datetime.utcnow()
+    updated = db.session.execute(
+        update(DataVersion)
+        .where(DataVersion.user_id == user_id)
+        .values(version=DataVersion.version + 1, updated_at=now)
+    ).rowcount
+    if not updated:
+        db.session.execute(
+            insert(DataVersion).values(user_id=user_id, version=1, updated_at=now))
+
+    for cache in list(_caches):
+        cache.invalidate_user(user_id)
@@ -1,15 +1,23 @@
 #!/usr/bin/env python3
 
+import os
 import sqlite3
 import json
-import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+import matplotlib
 from matplotlib.patches import Circle
 import argparse
 
+# Worker processes render without a display
+matplotlib.use('Agg')
+
+from plots import get_target_template  # noqa: E402
+from shots import load_shots  # noqa: E402
+
 debug = False
 
 
-def plot_shots(coordinates, filename="shot_coordinates.png", xcal=-20, ycal=10):
+def plot_shots(coordinates, filename="shot_coordinates.png", xcal=-20, ycal=10, dpi=300, format="png"):
     """
     Plot each (x, y) coordinate as a circle and mark the center point.
     Saves the result as an image file.
@@ -17,70 +25,91 @@ def plot_shots(coordinates, filename="shot_coordinates.png", xcal=-20, ycal=10):
     Parameters:
         coordinates (list of tuple): List of (x, y) coordinates.
         filename (str): Output image filename (default: 'shot_coordinates.png').
+        dpi (int): Resolution of PNG images (default: 300).
+        format (str): Image format, 'png' or 'svg' (default: 'png').
     """
     if not coordinates:
         raise ValueError("The coordinates list is empty.")
 
-    # Create the plot
-    fig, ax = plt.subplots(figsize=(6, 6))
-    n = 11
-    xscale = 2.2
-    ring = Circle((300, 250), radius=int(0.5 * 59.5 * xscale),
-                  fill=True, facecolor='black', edgecolor='black', linewidth=1)
-    ax.add_patch(ring)
-
-    for i in [5, 11.5, 27.5, 43.5, 59.5, 75.5, 91.5, 107.5, 123.5, 139.5, 155.5]:
-        if n > 7:
-            edgecolor = 'white'
-        else:
-            edgecolor = 'black'
-
-        ring = Circle((300, 250), radius=int(0.5 * i * xscale),
-                      fill=False, edgecolor=edgecolor, linewidth=1)
-        ax.add_patch(ring)
-        n -= 1
+    template = get_target_template('Ecoaims TAR-170/60L', figsize=(6, 6), dpi=dpi,
+                                   title="ShotRecord Shot Plot", tight=True)
 
     # ax.axline((0,250), (600,250), color='black', linewidth=1)
     # ax.axline((300,0), (300,500), color='black', linewidth=1)
     # Plot each coordinate as a circle
-    num = 0
-    for (x, y) in coordinates:
-        num += 1
-        circle = Circle((x + xcal, y + ycal), radius=9, fill=True,
-                        facecolor='yellow', edgecolor='black', linewidth=1)
-        ax.add_patch(circle)
-        ax.annotate(str(num), (x + xcal, y + ycal), color='blue',
-                    fontsize=7, ha='center', va='center')
-
-    ax.set_xlim(0, 600)
-    ax.set_ylim(0, 500)
-    ax.set_aspect('equal', adjustable='box')
-    ax.set_title("ShotRecord Shot Plot")
-    ax.axes.invert_yaxis()  # Invert y-axis to match coordinate system
-    ax.axis('off')  # Turn off the axis
+    def draw_overlay(ax, artists):
+        num = 0
+        for (x, y) in coordinates:
+            num += 1
+            circle = Circle((x + xcal, y + ycal), radius=9, fill=True,
+                            facecolor='yellow', edgecolor='black', linewidth=1)
+            artists.append(ax.add_patch(circle))
+            artists.append(ax.annotate(str(num), (x + xcal, y + ycal), color='blue',
+                                       fontsize=7, ha='center', va='center'))
 
     # Save the figure instead of showing it
-    plt.savefig(filename, dpi=300, bbox_inches="tight")
-    plt.close(fig)
-
-
-# Recursive function to find all "shot" elements
-def extract_shots(obj):
-    shots = []
-    if isinstance(obj, dict):
-        for key, value in obj.items():
-            if key == "shot":
-                if value is not False:
-                    shots.append(value)
-            else:
-                shots.extend(extract_shots(value))
-    elif isinstance(obj, list):
-        for item in obj:
-            shots.extend(extract_shots(item))
-    return shots
-
-
-def handle_ecoaims_db(db_path, game_id=None):
+    with open(filename, 'wb') as f:
+        f.write(template.render(draw_overlay, format=format).getvalue())
+
+
+def output_filename(game_id, output_dir=".", format="png"):
+    return os.path.join(output_dir, f"shotrecord_{game_id:05d}.{format}")
+
+
+def plot_game(game_id, shots, output_dir=".", format="png", dpi=300):
+    coords = [(shot["x"], shot["y"]) for shot in shots]
+
+    plot_shots(coords, filename=output_filename(game_id, output_dir, format),
+               dpi=dpi, format=format)
+
+
+def plot_games(rows, output_dir=".", format="png", dpi=300):
+    """Plot a chunk of (id, game) rows in a worker process, returns the number of plots."""
+    n = 0
+    for game_id, game in rows:
+        try:
+            plot_game(game_id, load_shots(game), output_dir, format, dpi)
+            n += 1
+        except ValueError as e:
+            print(f"Game {game_id} skipped: {e}")
+    return n
+
+
+def plot_games_parallel(cursor, jobs, chunk_size=32, incremental=False, output_dir=".", format="png", dpi=300):
+    """Stream rows from the cursor to a pool of worker processes in chunks."""
+    n_plotted = 0
+    n_skipped = 0
+    pending = set()
+
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+
+            chunk = []
+            for row in rows:
+                if incremental and os.path.exists(output_filename(row[0], output_dir, format)):
+                    n_skipped += 1
+                else:
+                    chunk.append((row[0], row[1]))
+
+            if not chunk:
+                continue
+
+            # Keep a bounded number of chunks in flight, so the whole DB is never in memory
+            if len(pending) >= 2 * jobs:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                n_plotted += sum(future.result() for future in done)
+
+            pending.add(executor.submit(plot_games, chunk, output_dir, format, dpi))
+
+        n_plotted += sum(future.result() for future in pending)
+
+    print(f"Plotted {n_plotted} games, skipped {n_skipped} existing plots")
+
+
+def handle_ecoaims_db(db_path, game_id=None, jobs=1, incremental=False, output_dir=".", format="png", dpi=300):
     """Import data from an Ecoaims SQLite database file.
     sqlite> .schema ekoaims_games
         CREATE TABLE ekoaims_games (
@@ -98,33 +127,35 @@ def handle_ecoaims_db(db_path, game_id=None):
     else:
         cursor.execute("SELECT * FROM ekoaims_games ORDER BY created DESC")
 
+    if jobs > 1:
+        plot_games_parallel(cursor, jobs, incremental=incremental,
+                            output_dir=output_dir, format=format, dpi=dpi)
+        conn.close()
+        return
+
+    n_plotted = 0
+    n_skipped = 0
     while True:
         row = cursor.fetchone()
         if row is None:
             break
 
-        data = json.loads(row[1])  # Parse JSON string into Python dict
+        if incremental and os.path.exists(output_filename(row[0], output_dir, format)):
+            n_skipped += 1
+            continue
 
         if debug:
             print("ID: {row[0]} Created: {row[3]}")
             print("Data:")
-            print(json.dumps(data, indent=4))
+            print(json.dumps(json.loads(row[1]), indent=4))
             print("Settings:")
             print(json.dumps(json.loads(row[2]), indent=4))
 
-        coords = []
-        all_shots = extract_shots(data)
-        for shot in all_shots:
-            # shot: false
-            # if shot == False:
-            #    continue
-
-            # print(json.dumps(shot, indent=4))
-            coords.append((shot["x"], shot["y"]))
-
-        plot_shots(coords, filename=f"shotrecord_{row[0]:05d}.png")
+        # Games without shots are skipped the same way as in the worker processes
+        n_plotted += plot_games([(row[0], row[1])], output_dir, format, dpi)
 
     conn.close()
+    print(f"Plotted {n_plotted} games, skipped {n_skipped} existing plots")
 
 
 if __name__ == '__main__':
@@ -133,10 +164,22 @@ if __name__ == '__main__':
                         help='Ecoaims ID of the game to plot shots for')
     parser.add_argument('--ecoaims_db', type=str, required=True,
                         help='Path to Ecoaims SQLite database file')
+    parser.add_argument('--jobs', type=int, default=1,
+                        help='Number of worker processes for plotting')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Skip games whose plot file already exists')
+    parser.add_argument('--format', choices=['png', 'svg'], default='png',
+                        help='Output file format')
+    parser.add_argument('--dpi', type=int, default=300,
+                        help='Resolution of PNG plots')
+    parser.add_argument('--output_dir', type=str, default='.',
+                        help='Directory for the plot files')
     parser.add_argument('--debug', action='store_true',
                         help='Enable debug mode')
     args = parser.parse_args()
     debug = args.debug
 
     if args.ecoaims_db:
-        handle_ecoaims_db(args.ecoaims_db, game_id=args.game_id)
+        handle_ecoaims_db(args.ecoaims_db, game_id=args.game_id, jobs=args.jobs,
+                          incremental=args.incremental, output_dir=args.output_dir,
+                          format=args.format, dpi=args.dpi)
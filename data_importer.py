@@ -1,25 +1,23 @@
+import hashlib
 import sqlite3
-import json
 import os
+import time
+from contextlib import nullcontext
 from datetime import datetime
-from models import db, Series, Shot, Metric
-from metrics import compute_metrics
-
-
-# Recursive function to find all "shot" elements
-def extract_shots(obj):
-    shots = []
-    if isinstance(obj, dict):
-        for key, value in obj.items():
-            if key == "shot":
-                if value is not False:
-                    shots.append(value)
-            else:
-                shots.extend(extract_shots(value))
-    elif isinstance(obj, list):
-        for item in obj:
-            shots.extend(extract_shots(item))
-    return shots
+from flask import current_app
+from sqlalchemy import insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from models import db, Series, Shot, User, ImportSource, METRIC_COLUMNS
+from aggregates import refresh_daily_aggregates
+from aggregation import get_zone, local_date
+from cache import bump_data_version
+from shotstore import make_records
+from metrics import compute_metrics_batch
+from shots import load_shots
+from instrumentation import timed
+
+# Number of games written per transaction when importing
+IMPORT_BATCH_SIZE = 500
 
 
 def transform_coordinates(origx, origy, source):
@@ -30,8 +28,123 @@ def transform_coordinates(origx, origy, source):
     return origx, origy  # No transformation
 
 
+def parse_ecoaims_game(source_id, shots, created_at):
+    """Turn the shots of one Ecoaims game into Series and Shot row dicts."""
+    total_points = 0.0
+    total_t = 0.0
+    shot_rows = []
+    shots_xy = []
+
+    for shot in shots:
+        total_points += shot.get('points', 0.0)
+        total_t += shot.get('time', 0.0)
+        x, y = transform_coordinates(
+            shot.get('x', 0), shot.get('y', 0), 'ecoaims')
+        shots_xy.append((x, y))
+        shot_rows.append({
+            'hit': shot.get("hit", 0),
+            'points': shot.get("points", 0.0),
+            'shotnum': shot.get("shotNumber", 0),
+            'origx': shot.get("x", 0),
+            'origy': shot.get("y", 0),
+            'x': x,
+            'y': y,
+            't': shot.get("time", 0.0)
+        })
+
+    series_row = {
+        'source_id': source_id,
+        'created_at': created_at,
+        'total_points': total_points,
+        'total_t': total_t,
+        'n': len(shot_rows)
+    }
+
+    return series_row, shot_rows, shots_xy
+
+
+def insert_ignore(table):
+    """INSERT that skips rows conflicting with a unique index, on SQLite and PostgreSQL."""
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        return postgresql.insert(table).on_conflict_do_nothing()
+    if dialect == 'sqlite':
+        return sqlite.insert(table).on_conflict_do_nothing()
+    return insert(table)
+
+
+@timed('write_series_batch')
+def write_series_batch(user_id, games):
+    """Write a batch of parsed games with bulk inserts. The caller owns the transaction.
+    Games another import stored meanwhile are skipped.
+    Returns the games written, the number of rows written and the shots as shot store records."""
+    # Every row has the same keys, so that the insert is not split into groups
+    no_metrics = dict.fromkeys(METRIC_COLUMNS.values())
+    series_rows = [dict(series_row, user_id=user_id, **no_metrics) for series_row, _, _ in games]
+
+    # Metrics of the whole batch are computed in one call, series without shots have none
+    measured = [series_row for series_row, (_, _, shots_xy) in zip(series_rows, games) if shots_xy]
+    # FIXME: s_ref should depend on the scale and target type
+    metrics = compute_metrics_batch(
+        [xy for _, _, shots_xy in games for xy in shots_xy],
+        [len(shots_xy) for _, _, shots_xy in games if shots_xy],
+        # 30 (beginner), 15 (intermediate), 7 (advanced), 4 (elite)
+        s_ref=int(2.2 * 15)
+    )
+    for series_row, values in zip(measured, metrics):
+        series_row.update({column: values[name] for name, column in METRIC_COLUMNS.items()})
+
+    # Skipped rows return nothing, the inserted ones are matched by their timestamp
+    series_ids = dict(db.session.execute(
+        insert_ignore(Series).returning(Series.created_at, Series.id),
+        series_rows
+    ).all())
+
+    written = []
+    shot_rows = []
+    shot_created = []
+    for game in games:
+        series_row, shots, _ = game
+        series_id = series_ids.get(series_row['created_at'])
+        if series_id is None:
+            continue
+
+        written.append(game)
+        shot_rows.extend(dict(shot, series_id=series_id) for shot in shots)
+        shot_created.extend([series_row['created_at']] * len(shots))
+
+    if shot_rows:
+        db.session.execute(insert(Shot), shot_rows)
+
+    records = make_records([shot['series_id'] for shot in shot_rows], shot_created, shot_rows)
+
+    return written, len(written) + len(shot_rows), records
+
+
+def source_fingerprint(conn):
+    """Identify a device database by its first game, None if it has no games."""
+    row = conn.execute("SELECT id, created, game FROM ekoaims_games ORDER BY id ASC LIMIT 1").fetchone()
+    if row is None:
+        return None
+
+    return hashlib.sha1('\0'.join(str(value) for value in row).encode()).hexdigest()
+
+
+def get_import_source(user_id, fingerprint):
+    """The user's ImportSource of the fingerprint, created if needed."""
+    # Another import of the same database may create it at the same time
+    db.session.execute(
+        insert_ignore(ImportSource).values(user_id=user_id, fingerprint=fingerprint))
+    db.session.commit()
+
+    return db.session.execute(
+        select(ImportSource).where(ImportSource.user_id == user_id, ImportSource.fingerprint == fingerprint)
+    ).scalar_one()
+
+
 # FIXME: get target type from settings (?)
-def import_ecoaims_db(db_path, user_id):
+@timed('import_ecoaims_db')
+def import_ecoaims_db(db_path, user_id, batch_size=IMPORT_BATCH_SIZE, progress=None, before_commit=None):
     """Import data from an Ecoaims SQLite database file.
     sqlite> .schema ekoaims_games
         CREATE TABLE ekoaims_games (
@@ -40,96 +153,134 @@ def import_ecoaims_db(db_path, user_id):
             settings TEXT NOT NULL,
             created TIMESTAMP DEFAULT CURRENT_TIMESTAMP
         );
+
+    Games are read and written in batches of batch_size, one transaction per batch.
+    Only games after the last one imported from the same database (identified by
+    its fingerprint) are read, games already stored are skipped.
+    If given, progress is called with the running statistics after each committed batch,
+    and before_commit in the transaction of each batch, an exception from it rolls
+    the batch back.
+    Returns a dict with import statistics.
     """
+    started = time.perf_counter()
+
     conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
-    cursor.execute(
-        "SELECT id, game, created FROM ekoaims_games ORDER BY id ASC")
 
+    n_imported = 0
     n_skipped = 0
+    n_rows = 0
+    shot_store = current_app.extensions.get('shot_store')
+    # Daily aggregates are by the user's local date
+    tz = get_zone(db.session.get(User, user_id).timezone, current_app.config.get('DEFAULT_TIMEZONE'))
 
-    while True:
-        row = cursor.fetchone()
-        if row is None:
-            break
+    try:
+        fingerprint = source_fingerprint(conn)
+        source = get_import_source(user_id, fingerprint) if fingerprint else None
+        source_pk = source.id if source else None
+        last_source_id = source.last_source_id if source else 0
 
-        source_id = row[0]
-        data = json.loads(row[1])  # Parse JSON string into Python dict
-        created_at = datetime.strptime(row[2], '%Y-%m-%d %H:%M:%S')
-        total_points = 0.0
-        total_t = 0.0
+        # Games up to the high-water mark were imported before
+        n_skipped = conn.execute(
+            "SELECT COUNT(*) FROM ekoaims_games WHERE id <= ?", (last_source_id,)).fetchone()[0]
+        cursor.execute(
+            "SELECT id, game, created FROM ekoaims_games WHERE id > ? ORDER BY id ASC", (last_source_id,))
 
-        # Check if this series already exists to avoid duplicates (good enough for now)
-        if Series.query.filter_by(user_id=user_id, created_at=created_at).first():
-            n_skipped += 1
-            continue
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+
+            # Games of the batch stored by an earlier import without a high-water mark, or
+            # from another copy of the device database. Duplicates are detected by timestamp.
+            created = [datetime.strptime(row[2], '%Y-%m-%d %H:%M:%S') for row in rows]
+            existing = set(db.session.execute(
+                select(Series.created_at)
+                .where(Series.user_id == user_id, Series.created_at.between(min(created), max(created)))
+            ).scalars())
+
+            games = []
+            for (source_id, game, _), created_at in zip(rows, created):
+                if created_at in existing:
+                    n_skipped += 1
+                    continue
+
+                existing.add(created_at)
+                games.append(parse_ecoaims_game(source_id, load_shots(game), created_at))
 
-        shots = extract_shots(data)
-        for shot in shots:
-            total_points += shot.get('points', 0.0)
-            total_t += shot.get('time', 0.0)
-
-        series = Series(
-            user_id=user_id,
-            source_id=source_id,
-            created_at=created_at,
-            total_points=total_points,
-            total_t=total_t,
-            n=len(shots)
-        )
-        db.session.add(series)
-        db.session.flush()  # Get the ID assigned by the database
-        series_id = series.id
-
-        shots_xy = []
-        for shot in shots:
-            x, y = transform_coordinates(
-                shot.get('x', 0), shot.get('y', 0), 'ecoaims')
-            shots_xy.append((x, y))
-            new_shot = Shot(
-                series_id=series_id,
-                hit=shot.get("hit", 0),
-                points=shot.get("points", 0.0),
-                shotnum=shot.get("shotNumber", 0),
-                origx=shot.get("x", 0),
-                origy=shot.get("y", 0),
-                x=x,
-                y=y,
-                t=shot.get("time", 0.0)
-            )
-            db.session.add(new_shot)
-
-        # FIXME: s_ref should depend on the scale and target type
-        metrics = compute_metrics(
-            shots_xy,
-            # 30 (beginner), 15 (intermediate), 7 (advanced), 4 (elite)
-            s_ref=int(2.2 * 15)
-        )
-
-        for key, value in metrics.items():
-            metric = Metric(
-                series_id=series_id,
-                name=key,
-                value=value
-            )
-            db.session.add(metric)
-
-        db.session.commit()
-
-        print(f"User ID: {user_id}, Series ID: {series_id}, Created: {created_at}, "
-              f"Points: {total_points:.1f}, Time: {total_t:.1f}")
-
-    conn.close()
-
-    print(f"User ID {user_id} import completed, "
-          f"skipped {n_skipped} existing series")
+            # The shot store lock is taken before the first write of the batch and held until
+            # its shots are appended, so concurrent imports of the user append in commit order
+            with shot_store.lock(user_id) if shot_store else nullcontext():
+                try:
+                    if games:
+                        # A concurrent import of the same games wins the unique index
+                        written, n_batch, records = write_series_batch(user_id, games)
+                        n_skipped += len(games) - len(written)
+                        n_rows += n_batch
+                        games = written
+
+                    if games:
+                        refresh_daily_aggregates(
+                            user_id, {local_date(series_row['created_at'], tz) for series_row, _, _ in games}, tz)
+                        bump_data_version(user_id)
+
+                    # The mark moves in the same transaction as the rows, and only forward
+                    if source_pk:
+                        last_source_id, last_created = rows[-1][0], rows[-1][2]
+                        db.session.execute(
+                            update(ImportSource)
+                            .where(ImportSource.id == source_pk, ImportSource.last_source_id < last_source_id)
+                            .values(last_source_id=last_source_id,
+                                    last_created_at=datetime.strptime(last_created, '%Y-%m-%d %H:%M:%S'),
+                                    updated_at=datetime.utcnow()))
+                    if before_commit:
+                        before_commit()
+                    db.session.commit()
+                except Exception:
+                    db.session.rollback()
+                    raise
+
+                if games and shot_store:
+                    shot_store.append(user_id, records)
+
+            if games:
+                n_imported += len(games)
+                print(f"User ID: {user_id}, imported {n_imported} series, "
+                      f"latest created: {games[-1][0]['created_at']}")
+
+            if progress:
+                progress({'imported': n_imported, 'skipped': n_skipped, 'rows': n_rows})
+    finally:
+        conn.close()
+
+    elapsed = time.perf_counter() - started
+    rate = n_rows / elapsed if elapsed > 0 else 0.0
+
+    print(f"User ID {user_id} import completed, imported {n_imported} series, "
+          f"skipped {n_skipped} existing series, "
+          f"{n_rows} rows in {elapsed:.2f}s ({rate:.0f} rows/s)")
+
+    return {
+        'imported': n_imported,
+        'skipped': n_skipped,
+        'rows': n_rows,
+        'elapsed': elapsed,
+        'rows_per_second': rate
+    }
 
 
 # FIXME: currently only imports Ecoaims DBs
-def import_data_from_file(filepath, user_id):
-    # Placeholder for the actual data import logic
+def import_data_from_file(filepath, user_id, progress=None, delete=True, before_commit=None):
     print(f"Importing user ID {user_id} data from {filepath}")
-    import_ecoaims_db(filepath, user_id)
-    print("Data import completed")
-    os.unlink(filepath)  # Delete the file after import
-    print(f"Deleted temporary file {filepath}")
+    try:
+        stats = import_ecoaims_db(
+            filepath, user_id,
+            batch_size=current_app.config.get('IMPORT_BATCH_SIZE', IMPORT_BATCH_SIZE),
+            progress=progress, before_commit=before_commit)
+        print("Data import completed")
+    finally:
+        if delete and os.path.exists(filepath):
+            os.unlink(filepath)  # Delete the file after import, also on failure
+            print(f"Deleted temporary file {filepath}")
+
+    return stats
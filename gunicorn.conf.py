@@ -0,0 +1,6 @@
+# Read by gunicorn from the working directory, see the run targets of the Makefile
+
+
+def post_worker_init(worker):
+    # Render processes import matplotlib while the worker waits for its first request
+    worker.wsgi.extensions['render_pool'].start()
@@ -0,0 +1,185 @@
+"""Request, SQL and named timer instrumentation.
+
+Latencies are collected into histograms served in the Prometheus text format at
+/metrics and every request is logged as one JSON line. The histograms are per
+process, with several gunicorn workers each worker reports its own.
+"""
+import hmac
+import json
+import logging
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from functools import wraps
+from flask import Response, abort, current_app, g, request
+from flask_login import current_user
+from sqlalchemy import event
+
+# Upper bounds of the histogram buckets in seconds
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+logger = logging.getLogger('shotrecord.instrumentation')
+
+# Queries of the current request or background job
+_local = threading.local()
+
+
+class Histogram:
+    """Thread-safe latency histogram with labels."""
+
+    def __init__(self, name, description, labels, buckets=BUCKETS):
+        self.name = name
+        self.description = description
+        self.labels = labels
+        self.buckets = buckets
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, seconds, *labels):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * len(self.buckets), 0.0, 0]
+            i = bisect_left(self.buckets, seconds)
+            if i < len(self.buckets):
+                series[0][i] += 1
+            series[1] += seconds
+            series[2] += 1
+
+    def exposition(self):
+        lines = [f'# HELP {self.name} {self.description}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            for labels, (counts, total, count) in sorted(self._series.items()):
+                label_text = ','.join(f'{name}="{_escape(value)}"' for name, value in zip(self.labels, labels))
+                prefix = label_text + ',' if label_text else ''
+                cumulative = 0
+                for bound, n in zip(self.buckets, counts):
+                    cumulative += n
+                    lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+                lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {count}')
+                lines.append(f'{self.name}_sum{{{label_text}}} {total}')
+                lines.append(f'{self.name}_count{{{label_text}}} {count}')
+
+        return '\n'.join(lines)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+REQUEST_DURATION = Histogram(
+    'http_request_duration_seconds', 'Request latency by endpoint.', ('method', 'endpoint', 'status'))
+SQL_DURATION = Histogram(
+    'sql_query_duration_seconds', 'SQL statement latency by the endpoint that ran it.', ('endpoint',))
+TIMER_DURATION = Histogram(
+    'timer_duration_seconds', 'Latency of named code sections.', ('name',))
+HISTOGRAMS = [REQUEST_DURATION, SQL_DURATION, TIMER_DURATION]
+
+
+@contextmanager
+def timer(name):
+    """Time a block of code into the timer histogram."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        TIMER_DURATION.observe(elapsed, name)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(json.dumps({'event': 'timer', 'name': name, 'duration_ms': round(elapsed * 1000, 3)}))
+
+
+def timed(name):
+    """Decorator version of timer."""
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            with timer(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # Kept on the execution, a failed statement never reaches _after_cursor_execute
+    if context is not None:
+        context.query_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, 'query_start', None)
+    if start is None:
+        return
+
+    elapsed = time.perf_counter() - start
+    SQL_DURATION.observe(elapsed, getattr(_local, 'endpoint', None) or 'background')
+    _local.queries = getattr(_local, 'queries', 0) + 1
+    _local.sql_time = getattr(_local, 'sql_time', 0.0) + elapsed
+
+
+def _before_request():
+    g.request_start = time.perf_counter()
+    _local.endpoint = request.endpoint or 'unknown'
+    _local.queries = 0
+    _local.sql_time = 0.0
+
+
+def _after_request(response):
+    start = g.pop('request_start', None)
+    if start is None:
+        return response
+
+    elapsed = time.perf_counter() - start
+    endpoint = request.endpoint or 'unknown'
+    REQUEST_DURATION.observe(elapsed, request.method, endpoint, response.status_code)
+    logger.info(json.dumps({
+        'event': 'request',
+        'method': request.method,
+        'path': request.path,
+        'endpoint': endpoint,
+        'status': response.status_code,
+        'duration_ms': round(elapsed * 1000, 3),
+        'sql_queries': _local.queries,
+        'sql_ms': round(_local.sql_time * 1000, 3)
+    }))
+    _local.endpoint = None
+
+    return response
+
+
+def metrics():
+    # Scrapers send METRICS_TOKEN as a bearer token, without one only logged in users see the metrics
+    token = current_app.config.get('METRICS_TOKEN')
+    if token:
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), f'Bearer {token}'):
+            abort(401)
+    elif not current_user.is_authenticated:
+        abort(401)
+
+    return Response('\n'.join(h.exposition() for h in HISTOGRAMS) + '\n',
+                    mimetype='text/plain; version=0.0.4')
+
+
+def init_app(app):
+    """Time requests and SQL statements and serve /metrics if METRICS_ENABLED is set,
+    call after db.init_app."""
+    if not app.config.get('METRICS_ENABLED'):
+        return
+
+    # Render processes import this module for timed, without the models
+    from models import db
+    with app.app_context():
+        engine = db.engine
+    event.listen(engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(engine, 'after_cursor_execute', _after_cursor_execute)
+
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        logger.addHandler(handler)
+    logger.setLevel(app.config.get('METRICS_LOG_LEVEL', 'INFO'))
+
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.add_url_rule('/metrics', 'metrics', metrics)
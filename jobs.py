@@ -0,0 +1,257 @@
+import multiprocessing
+import os
+import socket
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import and_, func, or_, select, update
+from data_importer import import_data_from_file
+from models import db, ImportJob
+
+
+class QueueFull(Exception):
+    pass
+
+
+def job_status(job):
+    return {
+        'id': job.id,
+        'status': job.status,
+        'series_imported': job.series_imported,
+        'series_skipped': job.series_skipped,
+        'rows_done': job.rows_done,
+        'error': job.error,
+        'created_at': job.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+        'updated_at': job.updated_at.strftime('%Y-%m-%d %H:%M:%S')
+    }
+
+
+class LeaseLost(Exception):
+    pass
+
+
+class ImportQueue:
+    """Import jobs persisted in the ImportJob table and run by worker threads.
+
+    Any number of processes can serve the same queue. A worker claims a queued job
+    with a conditional UPDATE and holds a lease on it that is renewed with every
+    progress update. Jobs whose lease expired, because their process died, are
+    claimed again and resume from the high-water mark of the device database.
+    SQLite allows a single writer, so one worker per process is the sensible default.
+    """
+
+    def __init__(self, app=None, notify=None):
+        self.notify = notify
+        self.app = None
+        self._wakeup = threading.Event()
+        self._workers = []
+        self._pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.config.setdefault('IMPORT_WORKERS', 1)
+        app.config.setdefault('IMPORT_QUEUE_SIZE', 32)
+        app.config.setdefault('IMPORT_LEASE_SECONDS', 300)
+        app.config.setdefault('IMPORT_POLL_INTERVAL', 2)
+
+        # Render processes run the main module again, they take no jobs
+        if multiprocessing.parent_process() is not None:
+            return
+
+        # Workers poll from the start, they also pick up jobs submitted by other processes
+        # and jobs left behind by processes that are gone
+        self._start_workers()
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    @property
+    def owner(self):
+        # The worker thread holding a lease, unique across hosts and processes
+        return f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
+
+    def _after_fork(self):
+        # Threads do not survive a fork, a forked process starts its own. The parent's
+        # threads may have held the lock or waited for the event at the fork.
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._start_workers()
+
+    def _start_workers(self):
+        with self._lock:
+            if self._workers and self._pid == os.getpid():
+                return
+
+            self._pid = os.getpid()
+            self._workers = []
+            for i in range(self.app.config['IMPORT_WORKERS']):
+                worker = threading.Thread(
+                    target=self._work, name=f'import-worker-{i}', daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def submit(self, filename, user_id):
+        queued = db.session.execute(
+            select(func.count(ImportJob.id)).where(ImportJob.status == 'queued')
+        ).scalar()
+
+        job = ImportJob(user_id=user_id, filename=filename)
+        if queued >= self.app.config['IMPORT_QUEUE_SIZE']:
+            job.status = 'failed'
+            job.error = 'Import queue is full'
+            db.session.add(job)
+            db.session.commit()
+            raise QueueFull()
+
+        db.session.add(job)
+        db.session.commit()
+
+        self._start_workers()
+        self._wakeup.set()
+        self._notify(job)
+
+        return job
+
+    def _notify(self, job):
+        if self.notify:
+            self.notify(job.user_id, job_status(job))
+
+    def _lease_expires(self):
+        return datetime.utcnow() + timedelta(seconds=self.app.config['IMPORT_LEASE_SECONDS'])
+
+    def _claimable(self, now):
+        return or_(ImportJob.status == 'queued',
+                   and_(ImportJob.status == 'running', ImportJob.lease_expires < now))
+
+    def _claim(self):
+        """Claim the oldest claimable job, returns its ID or None."""
+        now = datetime.utcnow()
+        candidates = db.session.execute(
+            select(ImportJob.id).where(self._claimable(now)).order_by(ImportJob.id).limit(8)
+        ).scalars().all()
+
+        for job_id in candidates:
+            # Only one process can win the conditional update
+            claimed = db.session.execute(
+                update(ImportJob)
+                .where(ImportJob.id == job_id, self._claimable(now))
+                .values(status='running', lease_owner=self.owner,
+                        lease_expires=self._lease_expires(), updated_at=now)
+            ).rowcount
+            db.session.commit()
+            if claimed:
+                return job_id
+
+        return None
+
+    def _renew(self, job_id, owner):
+        """Extend the lease of a job held by owner in the current transaction, returns
+        False if another process took it over."""
+        return db.session.execute(
+            update(ImportJob)
+            .where(ImportJob.id == job_id, ImportJob.lease_owner == owner)
+            .values(lease_expires=self._lease_expires())
+        ).rowcount > 0
+
+    def _heartbeat(self, job_id, owner, stop):
+        # Keeps the lease while a long batch runs, its own thread and session
+        interval = self.app.config['IMPORT_LEASE_SECONDS'] / 3
+        while not stop.wait(interval):
+            try:
+                with self.app.app_context():
+                    renewed = self._renew(job_id, owner)
+                    db.session.commit()
+                if not renewed:
+                    return
+            except Exception as e:
+                print(f"Renewing the lease of import job {job_id} failed: {e}")
+
+    def _update(self, job_id, **values):
+        """Update a job held by this process, raises LeaseLost if another process took it over."""
+        # Every update renews the lease
+        values.update(updated_at=datetime.utcnow(), lease_expires=self._lease_expires())
+
+        updated = db.session.execute(
+            update(ImportJob)
+            .where(ImportJob.id == job_id, ImportJob.lease_owner == self.owner)
+            .values(**values)
+        ).rowcount
+        db.session.commit()
+        if not updated:
+            raise LeaseLost(f"Lost the lease of import job {job_id}")
+
+        job = db.session.get(ImportJob, job_id, populate_existing=True)
+        self._notify(job)
+
+    def _work(self):
+        while True:
+            job_id = None
+            try:
+                with self.app.app_context():
+                    job_id = self._claim()
+                    if job_id is not None:
+                        self._run(job_id)
+            except Exception as e:
+                print(f"Import worker failed on job {job_id}: {e}")
+
+            if job_id is None:
+                self._wakeup.wait(self.app.config['IMPORT_POLL_INTERVAL'])
+                self._wakeup.clear()
+
+    def _run(self, job_id):
+        job = db.session.get(ImportJob, job_id)
+        user_id, filename = job.user_id, job.filename
+        if not os.path.exists(filename):
+            self._update(job_id, status='failed', error='Uploaded file is missing', lease_owner=None)
+            return
+
+        def progress(stats):
+            self._update(job_id,
+                         series_imported=stats['imported'],
+                         series_skipped=stats['skipped'],
+                         rows_done=stats['rows'])
+
+        owner = self.owner
+
+        def before_commit():
+            # A batch is only committed by the process holding the job, the lease check
+            # is part of the batch's transaction
+            if not self._renew(job_id, owner):
+                raise LeaseLost(f"Lost the lease of import job {job_id}")
+
+        stop = threading.Event()
+        heartbeat = threading.Thread(
+            target=self._heartbeat, args=(job_id, owner, stop), name=f'import-lease-{job_id}', daemon=True)
+        heartbeat.start()
+
+        self._notify(job)
+        try:
+            # The file stays until the job is finished, another process may resume it
+            stats = import_data_from_file(filename, user_id, progress=progress, delete=False,
+                                          before_commit=before_commit)
+        except LeaseLost:
+            db.session.rollback()
+            raise
+        except Exception as e:
+            db.session.rollback()
+            # Raises LeaseLost and leaves the file to the new owner if the job was taken over
+            self._update(job_id, status='failed', error=str(e)[:256], lease_owner=None)
+            _remove(filename)
+            raise
+        finally:
+            stop.set()
+            heartbeat.join()
+
+        self._update(job_id,
+                     status='done',
+                     series_imported=stats['imported'],
+                     series_skipped=stats['skipped'],
+                     rows_done=stats['rows'],
+                     lease_owner=None)
+        _remove(filename)
+
+
+def _remove(filename):
+    if os.path.exists(filename):
+        os.unlink(filename)
+        print(f"Deleted temporary file {filename}")
@@ -2,38 +2,158 @@
 # http://ballistipedia.com/index.php?title=Measuring_Precision
 
 import math
-from itertools import combinations
+import numpy as np
+from instrumentation import timed
 
+# Series up to this many shots get their extreme spread from a pairwise
+# distance matrix, larger ones from the convex hull
+PAIRWISE_MAX_SHOTS = 32
+# Number of series in one stacked distance matrix, bounds the memory use
+PAIRWISE_CHUNK = 256
 
+
+def _cross(o, a, b):
+    return (a[0] - o[0]) * (b[1] - o[1]) - (a[1] - o[1]) * (b[0] - o[0])
+
+
+def convex_hull(points):
+    """Return the convex hull vertices of an (n, 2) array (Andrew's monotone chain, O(n log n))."""
+    pts = np.unique(np.asarray(points, dtype=float).reshape(-1, 2), axis=0)
+    if len(pts) <= 2:
+        return pts
+
+    lower = []
+    upper = []
+    for p in pts.tolist():
+        while len(lower) >= 2 and _cross(lower[-2], lower[-1], p) <= 0:
+            lower.pop()
+        lower.append(p)
+    for p in reversed(pts.tolist()):
+        while len(upper) >= 2 and _cross(upper[-2], upper[-1], p) <= 0:
+            upper.pop()
+        upper.append(p)
+
+    return np.array(lower[:-1] + upper[:-1])
+
+
+def extreme_spread(points):
+    """Maximum center-to-center distance, the farthest pair is always on the convex hull.
+    Rotating calipers walk the counter-clockwise hull in O(h), O(n log n) in all."""
+    hull = convex_hull(points).tolist()
+    h = len(hull)
+    if h < 2:
+        return 0.0
+
+    extreme = 0.0
+    j = 1
+    for i in range(h):
+        a, b = hull[i], hull[(i + 1) % h]
+        # Advance to the vertex farthest from the edge a-b
+        while abs(_cross(a, b, hull[(j + 1) % h])) > abs(_cross(a, b, hull[j])):
+            j = (j + 1) % h
+        extreme = max(extreme,
+                      math.hypot(a[0] - hull[j][0], a[1] - hull[j][1]),
+                      math.hypot(b[0] - hull[j][0], b[1] - hull[j][1]))
+
+    return extreme
+
+
+def _batch_extreme_spread(xy, starts, counts):
+    # Series of equal length are stacked and their pairwise distances computed at once,
+    # long series go through the convex hull
+    extreme = np.zeros(len(counts))
+
+    for k in np.unique(counts):
+        selected = np.flatnonzero(counts == k)
+        if k < 2:
+            continue
+        if k > PAIRWISE_MAX_SHOTS:
+            for i in selected:
+                extreme[i] = extreme_spread(xy[starts[i]:starts[i] + k])
+            continue
+
+        for j in range(0, len(selected), PAIRWISE_CHUNK):
+            chunk = selected[j:j + PAIRWISE_CHUNK]
+            stacked = xy[starts[chunk][:, None] + np.arange(k)]
+            d = stacked[:, :, None, :] - stacked[:, None, :, :]
+            extreme[chunk] = np.sqrt((d * d).sum(axis=-1).max(axis=(1, 2)))
+
+    return extreme
+
+
+@timed('compute_metrics_batch')
+def compute_metrics_batch(shots, counts, s_ref=50.0):
+    """Compute metrics for a batch of series in one pass.
+
+    shots is the concatenation of all series as an (N, 2) array of x, y and counts
+    holds the number of shots in each series (a ragged array). Returns a list of
+    metric dicts, one per series.
+    """
+    xy = np.asarray(shots, dtype=float).reshape(-1, 2)
+    counts = np.asarray(counts, dtype=np.intp)
+    if counts.size == 0:
+        return []
+    if (counts <= 0).any():
+        raise ValueError("Every series must have at least one shot")
+    if counts.sum() != len(xy):
+        raise ValueError("Shot counts do not match the number of shots")
+
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    series = np.repeat(np.arange(len(counts)), counts)
+
+    mx = np.add.reduceat(xy[:, 0], starts) / counts
+    my = np.add.reduceat(xy[:, 1], starts) / counts
+    r = np.hypot(xy[:, 0] - mx[series], xy[:, 1] - my[series])
+    mr = np.add.reduceat(r, starts) / counts
+    rsd = np.sqrt(np.add.reduceat((r - mr[series]) ** 2, starts) / counts)
+    rms = np.sqrt(np.add.reduceat(r * r, starts) / counts)
+
+    # extreme spread (max center-to-center distance)
+    extreme = _batch_extreme_spread(xy, starts, counts)
+
+    # simple consistency score: clamp to [0,100]
+    # TODO: s_ref is user-specific
+    consistency = np.maximum(0.0, 100.0 * (1.0 - rsd / s_ref))
+
+    return [
+        {
+            "MPI_x": float(mx[i]),
+            "MPI_y": float(my[i]),
+            "MeanRadius": float(mr[i]),
+            "RadialStdDev": float(rsd[i]),
+            "RMS": float(rms[i]),
+            "ExtremeSpread": float(extreme[i]),
+            "ConsistencyPct": float(consistency[i])
+        }
+        for i in range(len(counts))
+    ]
+
+
+@timed('compute_metrics')
 def compute_metrics(shots, s_ref=50.0):
-    n = len(shots)
-    xs = [p[0] for p in shots]
-    ys = [p[1] for p in shots]
+    xy = np.asarray(shots, dtype=float).reshape(-1, 2)
+    if len(xy) == 0:
+        raise ValueError("Cannot compute metrics without shots")
 
-    mx = sum(xs) / n
-    my = sum(ys) / n
-    r = [math.hypot(x-mx, y-my) for x, y in shots]
-    mr = sum(r) / n
-    rsd = math.sqrt(sum((ri - mr)**2 for ri in r) / n)
-    rms = math.sqrt(sum(ri*ri for ri in r) / n)
+    mx, my = xy.mean(axis=0)
+    r = np.hypot(xy[:, 0] - mx, xy[:, 1] - my)
+    mr = r.mean()
+    rsd = np.sqrt(((r - mr) ** 2).mean())
+    rms = np.sqrt((r * r).mean())
 
     # extreme spread (max center-to-center distance)
-    extreme = 0.0
-    for (x1, y1), (x2, y2) in combinations(shots, 2):
-        d = math.hypot(x1-x2, y1-y2)
-        if d > extreme:
-            extreme = d
+    extreme = extreme_spread(xy)
 
     # simple consistency score: clamp to [0,100]
     # TODO: s_ref is user-specific
     consistency = max(0.0, 100.0 * (1.0 - rsd / s_ref))
 
     return {
-        "MPI_x": mx,
-        "MPI_y": my,
-        "MeanRadius": mr,
-        "RadialStdDev": rsd,
-        "RMS": rms,
+        "MPI_x": float(mx),
+        "MPI_y": float(my),
+        "MeanRadius": float(mr),
+        "RadialStdDev": float(rsd),
+        "RMS": float(rms),
         "ExtremeSpread": extreme,
-        "ConsistencyPct": consistency
+        "ConsistencyPct": float(consistency)
     }
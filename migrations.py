@@ -0,0 +1,116 @@
+"""Schema changes that db.create_all() does not make to existing tables.
+
+Every migration inspects the schema first, so running them on each start is safe.
+"""
+import warnings
+from sqlalchemy import inspect, text
+from models import db, Series, User, DailyAggregate, ImportJob, METRIC_COLUMNS
+
+
+def add_columns(conn, table, columns):
+    """Add the columns missing from an existing table, returns the names of the added columns."""
+    existing = {column['name'] for column in inspect(conn).get_columns(table.name)}
+    added = []
+    for column in columns:
+        if column.name in existing:
+            continue
+
+        column_type = column.type.compile(dialect=conn.dialect)
+        conn.execute(text(f'ALTER TABLE "{table.name}" ADD COLUMN "{column.name}" {column_type}'))
+        added.append(column.name)
+
+    return added
+
+
+def remove_duplicate_series(conn):
+    # Before the unique index on (user_id, created_at) exists, concurrent imports could
+    # store a game twice. The first copy is kept.
+    with warnings.catch_warnings():
+        warnings.filterwarnings('ignore', 'Skipped unsupported reflection of expression-based index')
+        if 'ux_series_user_id_created_at' in {index['name'] for index in inspect(conn).get_indexes('series')}:
+            return
+
+    duplicates = ('SELECT id FROM series WHERE id NOT IN '
+                  '(SELECT MIN(id) FROM series GROUP BY user_id, created_at)')
+    users = conn.execute(text(
+        'SELECT DISTINCT user_id FROM series WHERE id IN (' + duplicates + ')')).scalars().all()
+    if not users:
+        return
+
+    for table in ('shot', 'metric'):
+        conn.execute(text(f'DELETE FROM {table} WHERE series_id IN ({duplicates})'))
+    conn.execute(text(f'DELETE FROM series WHERE id IN ({duplicates})'))
+
+    # Aggregates and cached results of the users counted the duplicates
+    for user_id in users:
+        conn.execute(text('DELETE FROM daily_aggregate WHERE user_id = :user_id'), {'user_id': user_id})
+        conn.execute(text('UPDATE data_version SET version = version + 1 WHERE user_id = :user_id'),
+                     {'user_id': user_id})
+    print(f"Removed duplicate series of {len(users)} users")
+
+
+def drop_replaced_series_indexes(conn):
+    # Replaced by ux_series_user_id_created_at
+    for name in ('ix_series_user_id_created_at', 'ux_series_user_id_source_id_created_at'):
+        conn.execute(text(f'DROP INDEX IF EXISTS {name}'))
+
+
+def create_missing_indexes(conn):
+    # Indexes declared on the models after their table was created
+    with warnings.catch_warnings():
+        # Reflection skips the expression index made by create_series_date_index
+        warnings.filterwarnings('ignore', 'Skipped unsupported reflection of expression-based index')
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
+
+
+def add_series_metric_columns(conn):
+    table = Series.__table__
+    added = add_columns(conn, table, [table.c[column] for column in METRIC_COLUMNS.values()])
+
+    # Back-fill the new columns from the name/value metric rows
+    for name, column in METRIC_COLUMNS.items():
+        if column in added:
+            conn.execute(
+                text(f'UPDATE series SET "{column}" = '
+                     '(SELECT value FROM metric WHERE metric.series_id = series.id AND metric.name = :name)'),
+                {'name': name})
+
+
+def add_user_timezone_column(conn):
+    add_columns(conn, User.__table__, [User.__table__.c.timezone])
+
+
+def add_daily_aggregate_timezone_column(conn):
+    # Existing aggregates have no timezone and are rebuilt on first use
+    add_columns(conn, DailyAggregate.__table__, [DailyAggregate.__table__.c.timezone])
+
+
+def add_import_job_lease_columns(conn):
+    table = ImportJob.__table__
+    add_columns(conn, table, [table.c.lease_owner, table.c.lease_expires])
+
+
+def create_series_date_index(conn):
+    # Per-day grouping of UTC users, the expression must match the one in the queries
+    if conn.dialect.name in ('sqlite', 'postgresql'):
+        conn.execute(text('CREATE INDEX IF NOT EXISTS ix_series_user_id_date ON series (user_id, date(created_at))'))
+
+
+MIGRATIONS = [
+    remove_duplicate_series,
+    create_missing_indexes,
+    drop_replaced_series_indexes,
+    add_series_metric_columns,
+    add_user_timezone_column,
+    add_daily_aggregate_timezone_column,
+    create_series_date_index,
+    add_import_job_lease_columns,
+]
+
+
+def upgrade(engine):
+    with engine.begin() as conn:
+        for migration in MIGRATIONS:
+            migration(conn)
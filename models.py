@@ -11,8 +11,43 @@ class Base(DeclarativeBase):
 
 db = SQLAlchemy(model_class=Base)
 
+# Names of the compute_metrics outputs and the columns they are stored in
+METRIC_COLUMNS = {
+    'MPI_x': 'mpi_x',
+    'MPI_y': 'mpi_y',
+    'MeanRadius': 'mean_radius',
+    'RadialStdDev': 'radial_std_dev',
+    'RMS': 'rms',
+    'ExtremeSpread': 'extreme_spread',
+    'ConsistencyPct': 'consistency_pct'
+}
+
+
+# One column per compute_metrics output
+class MetricsMixin:
+    mpi_x = db.Column(db.Float, nullable=True)
+    mpi_y = db.Column(db.Float, nullable=True)
+    mean_radius = db.Column(db.Float, nullable=True)
+    radial_std_dev = db.Column(db.Float, nullable=True)
+    rms = db.Column(db.Float, nullable=True)
+    extreme_spread = db.Column(db.Float, nullable=True)
+    consistency_pct = db.Column(db.Float, nullable=True)
+
+    @property
+    def metrics(self):
+        """Metrics by their compute_metrics names, empty if there are none."""
+        if self.mpi_x is None:
+            return {}
+        return {name: getattr(self, column) for name, column in METRIC_COLUMNS.items()}
+
+
+class Series(MetricsMixin, db.Model):
+    # Listings are per user in time order
+    __table_args__ = (
+        # A game is imported once, duplicates are detected by timestamp
+        db.Index('ux_series_user_id_created_at', 'user_id', 'created_at', unique=True),
+    )
 
-class Series(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
     target_type = db.Column(db.String(64), nullable=False, default='10m ISSF Air Pistol')
@@ -50,11 +85,15 @@ class User(UserMixin, db.Model):
     id = db.Column(db.Integer, primary_key=True)
     username = db.Column(db.String(32), unique=True, nullable=False)
     password = db.Column(db.String(32), nullable=False)
+    # IANA timezone name, the server's local timezone if not set
+    timezone = db.Column(db.String(64))
 
     def __repr__(self):
         return f"<User {self.username}>"
 
 
+# Legacy name/value metrics, superseded by the metric columns of Series.
+# Kept to back-fill databases created before the columns existed.
 class Metric(db.Model):
     id = db.Column(db.Integer, primary_key=True)
     series_id = db.Column(db.Integer, db.ForeignKey('series.id'), nullable=False, index=True)
@@ -64,3 +103,67 @@ class Metric(db.Model):
 
     def __repr__(self):
         return f"<Metric {self.name}={self.value} for Series {self.series_id}>"
+
+
+class ImportJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False, index=True)
+    filename = db.Column(db.String(256), nullable=False)
+    # queued, running, done or failed
+    status = db.Column(db.String(16), nullable=False, default='queued', index=True)
+    series_imported = db.Column(db.Integer, nullable=False, default=0)
+    series_skipped = db.Column(db.Integer, nullable=False, default=0)
+    rows_done = db.Column(db.Integer, nullable=False, default=0)
+    error = db.Column(db.String(256), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    # Process running the job, and until when it holds the job without renewing
+    lease_owner = db.Column(db.String(128), nullable=True)
+    lease_expires = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f"<ImportJob {self.id} {self.status} for User {self.user_id}>"
+
+
+# High-water mark of the imports from one device database
+class ImportSource(db.Model):
+    __table_args__ = (
+        db.UniqueConstraint('user_id', 'fingerprint'),
+    )
+
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    # Hash of the first game, which stays the same as the device database grows
+    fingerprint = db.Column(db.String(40), nullable=False)
+    last_source_id = db.Column(db.Integer, nullable=False, default=0)
+    last_created_at = db.Column(db.DateTime, nullable=True)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<ImportSource {self.fingerprint[:8]} of User {self.user_id} at {self.last_source_id}>"
+
+
+# Materialized per-day totals and pooled metrics of all shots of the day
+class DailyAggregate(MetricsMixin, db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    date = db.Column(db.Date, primary_key=True)
+    n_series = db.Column(db.Integer, nullable=False)
+    n_shots = db.Column(db.Integer, nullable=False)
+    total_points = db.Column(db.Float, nullable=False)
+    # Pooled shot coordinates as JSON [[x, y], ...]
+    shots = db.Column(db.Text, nullable=False, default='[]')
+    # Timezone the date is local to, aggregates of another timezone are rebuilt
+    timezone = db.Column(db.String(64), nullable=True)
+
+    def __repr__(self):
+        return f"<DailyAggregate {self.date} for User {self.user_id}>"
+
+
+# Per-user counter bumped whenever the user's data changes, used in cache keys
+class DataVersion(db.Model):
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f"<DataVersion {self.version} for User {self.user_id}>"
@@ -1,10 +1,17 @@
+import threading
+import matplotlib.image as mpimg
 import matplotlib.pyplot as plt
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+from matplotlib.figure import Figure
 from matplotlib.patches import Circle
 from matplotlib.ticker import MaxNLocator
+from datetime import timezone
 from io import BytesIO
 import numpy as np
+from instrumentation import timed
 
 
+@timed('weekly_series_plot')
 def weekly_series_plot(formatted):
 
     weeks = [entry['week'] for entry in formatted]
@@ -60,101 +67,191 @@ def weekly_series_plot(formatted):
     return buf
 
 
-def generate_target(series):
-    # FIXME: ensure shots are in order
-    shotdata = [(i.x, i.y, i.shotnum) for i in series.shot]
-    fig, ax = plt.subplots(figsize=(6, 5))
-    xscale = 2.2  # FIXME: this should be a parameter
+# Ring diameters in mm of the Ecoaims 10m air pistol target, from the 10 ring outwards
+TARGET_RINGS = [5, 11.5, 27.5, 43.5, 59.5, 75.5, 91.5, 107.5, 123.5, 139.5, 155.5]
+TARGET_CENTER = (300, 250)
 
-    x0 = 10
-    y0 = 10
-    lf = 20
-    ax.annotate(series.description, (x0, y0), color='black',
-                fontsize=8, ha='left', va='center')
-    y0 += lf
-    ax.annotate(series.created_at.strftime('%Y-%m-%d %H:%M'), (x0, y0), color='black',
-                fontsize=8, ha='left', va='center')
-    y0 += lf
-    ax.annotate(f"Points: {series.total_points:.1f} Time: {series.total_t:.1f}", (x0, y0), color='black',
-                fontsize=8, ha='left', va='center')
-    y0 += lf
-
-    # TODO: Add precision metric (requires calibration, a.u. not suitable)
-
-    pct = next((m.value for m in series.metric if m.name ==
-               'ConsistencyPct'), None)
-    if pct:
-        ax.annotate(f"Consistency: {pct:.1f}%", (x0, y0), color='black',
-                    fontsize=8, ha='left', va='center')
-        y0 += lf
 
-    for shot in series.shot:
-        ax.annotate(f"Shot {shot.shotnum}: {shot.points:.1f}", (x0, y0), color='black',
-                    fontsize=8, ha='left', va='center')
-        y0 += lf
-
-    ring = Circle((300, 250), radius=int(0.5 * 59.5 * xscale),
+def draw_target(ax, xscale):
+    ring = Circle(TARGET_CENTER, radius=int(0.5 * 59.5 * xscale),
                   fill=True, facecolor='black', edgecolor='black', linewidth=1)
     ax.add_patch(ring)
 
     n = 11
-    for i in [5, 11.5, 27.5, 43.5, 59.5, 75.5, 91.5, 107.5, 123.5, 139.5, 155.5]:
+    for i in TARGET_RINGS:
         if n > 7:
             edgecolor = 'white'
         else:
             edgecolor = 'black'
 
-        ring = Circle((300, 250), radius=int(0.5 * i * xscale),
+        ring = Circle(TARGET_CENTER, radius=int(0.5 * i * xscale),
                       fill=False, edgecolor=edgecolor, linewidth=1)
         ax.add_patch(ring)
         n -= 1
 
-    # Plot the Main Point of Impact (MPI)
-    x0 = next((m.value for m in series.metric if m.name == 'MPI_x'), None)
-    y0 = next((m.value for m in series.metric if m.name == 'MPI_y'), None)
-    if x0 and y0:
-        delta = 50
-        x0 = int(x0)
-        y0 = int(y0)
-        x = [(x0 - delta), (x0 + delta)]
-        y = [(y0), (y0)]
-        ax.plot(x, y, linewidth=0.8, color='orange')
-        x = [(x0), (x0)]
-        y = [(y0 - delta), (y0 + delta)]
-        ax.plot(x, y, linewidth=0.8, color='orange')
-
-    # Plot each shot as a circle
-    for (x, y, n) in shotdata:
-        circle = Circle((x, y), radius=9, fill=True,
-                        facecolor='yellow', edgecolor='black', linewidth=1)
-        ax.add_patch(circle)
-        if n > 0:
-            ax.annotate(str(n), (x, y), color='blue',
-                        fontsize=7, ha='center', va='center')
-
-    ax.set_xlim(0, 600)
-    ax.set_ylim(0, 500)
-    ax.set_aspect('equal', adjustable='box')
-    ax.axes.invert_yaxis()
-    ax.axis('off')  # Turn off the axis
-    plt.tight_layout()
-
-    buf = BytesIO()
-    plt.savefig(buf, format='png')
-    buf.seek(0)
-    plt.close(fig)
 
-    return buf
-
-
-def median_points(series):
-    data = []
-
-    for s in series:
-        points = []
-        for shot in s.shot:
-            points.append(shot.points)
-
-        data.append(np.median(np.array(points)))
+class TargetTemplate:
+    """Figure with the target background rendered once.
+
+    PNGs are produced by restoring the rendered background and drawing only the
+    per-series artists on top of it. Other formats are saved from the figure.
+    """
+
+    def __init__(self, xscale, figsize, dpi, title=None, tight=False):
+        self.fig = Figure(figsize=figsize, dpi=dpi)
+        self.canvas = FigureCanvasAgg(self.fig)
+        self.ax = self.fig.add_subplot()
+        self.tight = tight
+        self.lock = threading.Lock()
+
+        draw_target(self.ax, xscale)
+        self.ax.set_xlim(0, 600)
+        self.ax.set_ylim(0, 500)
+        self.ax.set_aspect('equal', adjustable='box')
+        if title:
+            self.ax.set_title(title)
+        self.ax.axes.invert_yaxis()
+        self.ax.axis('off')  # Turn off the axis
+        if not tight:
+            self.fig.tight_layout()
+
+        self.canvas.draw()
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+
+        # Pixel region of bbox_inches="tight", shots are clipped to the axes so it does not change
+        self.crop = None
+        if tight:
+            bbox = self.fig.get_tightbbox(self.canvas.get_renderer()).padded(0.1)
+            height = self.fig.bbox.height
+            x0, y0, x1, y1 = (np.array(bbox.extents) * dpi).round().astype(int)
+            self.crop = (slice(max(0, int(height) - y1), int(height) - y0), slice(max(0, x0), x1))
+
+    def render(self, draw_overlay, format='png'):
+        """Draw the overlay over the target and return the image. draw_overlay(ax, artists)
+        adds the per-series artists to ax and appends them to artists."""
+        buf = BytesIO()
+
+        with self.lock:
+            # Artists added before a failure are removed as well, the axes are shared
+            artists = []
+            try:
+                draw_overlay(self.ax, artists)
+                if format == 'png':
+                    self.canvas.restore_region(self.background)
+                    # Same stacking as a full draw: patches, then lines, then text
+                    for artist in sorted(artists, key=lambda a: a.get_zorder()):
+                        self.ax.draw_artist(artist)
+                    image = np.asarray(self.canvas.buffer_rgba())
+                    if self.crop:
+                        image = image[self.crop]
+                    mpimg.imsave(buf, image, format='png', dpi=self.fig.dpi)
+                else:
+                    self.fig.savefig(buf, format=format,
+                                     bbox_inches='tight' if self.tight else None)
+            finally:
+                for artist in artists:
+                    artist.remove()
+
+        buf.seek(0)
+        return buf
+
+
+_templates = {}
+_templates_lock = threading.Lock()
+
+
+# Target is hardcoded for Ecoaims 10m air pistol system in this version,
+# the target model only keeps templates of different targets apart.
+def get_target_template(target_model, xscale=2.2, figsize=(6, 5), dpi=100, title=None, tight=False):
+    key = (target_model, xscale, figsize, dpi, title, tight)
+    with _templates_lock:
+        template = _templates.get(key)
+        if template is None:
+            template = _templates[key] = TargetTemplate(xscale, figsize, dpi, title=title, tight=tight)
+
+    return template
+
+
+def target_spec(series, tz=None):
+    """Everything generate_target draws for a series as plain values, so that the
+    target can be rendered in another process."""
+    # Stored timestamps are naive UTC
+    created_at = series.created_at
+    if tz is not None:
+        created_at = created_at.replace(tzinfo=timezone.utc).astimezone(tz)
+
+    return {
+        'target_model': series.target_model,
+        'description': series.description,
+        'created_at': created_at.strftime('%Y-%m-%d %H:%M'),
+        'total_points': series.total_points,
+        'total_t': series.total_t,
+        'consistency_pct': series.consistency_pct,
+        # FIXME: ensure shots are in order
+        'shots': [(shot.x, shot.y, shot.shotnum, shot.points) for shot in series.shot],
+        'mpi': (series.mpi_x, series.mpi_y)
+    }
+
+
+def render_target(spec, format='png'):
+    """Draw a target from target_spec()."""
+    xscale = 2.2  # FIXME: this should be a parameter
+    template = get_target_template(spec['target_model'], xscale=xscale)
+
+    def draw_overlay(ax, artists):
+        x0 = 10
+        y0 = 10
+        lf = 20
+        artists.append(ax.annotate(spec['description'], (x0, y0), color='black',
+                                   fontsize=8, ha='left', va='center'))
+        y0 += lf
+        artists.append(ax.annotate(spec['created_at'], (x0, y0), color='black',
+                                   fontsize=8, ha='left', va='center'))
+        y0 += lf
+        total_t = spec['total_t']
+        time_text = f"{total_t:.1f}" if total_t is not None else '-'
+        artists.append(ax.annotate(f"Points: {spec['total_points']:.1f} Time: {time_text}", (x0, y0),
+                                   color='black', fontsize=8, ha='left', va='center'))
+        y0 += lf
 
-    return data
+        # TODO: Add precision metric (requires calibration, a.u. not suitable)
+
+        pct = spec['consistency_pct']
+        if pct:
+            artists.append(ax.annotate(f"Consistency: {pct:.1f}%", (x0, y0), color='black',
+                                       fontsize=8, ha='left', va='center'))
+            y0 += lf
+
+        for (_, _, n, points) in spec['shots']:
+            artists.append(ax.annotate(f"Shot {n}: {points:.1f}", (x0, y0), color='black',
+                                       fontsize=8, ha='left', va='center'))
+            y0 += lf
+
+        # Plot the Main Point of Impact (MPI)
+        x0, y0 = spec['mpi']
+        if x0 and y0:
+            delta = 50
+            x0 = int(x0)
+            y0 = int(y0)
+            x = [(x0 - delta), (x0 + delta)]
+            y = [(y0), (y0)]
+            artists.extend(ax.plot(x, y, linewidth=0.8, color='orange'))
+            x = [(x0), (x0)]
+            y = [(y0 - delta), (y0 + delta)]
+            artists.extend(ax.plot(x, y, linewidth=0.8, color='orange'))
+
+        # Plot each shot as a circle
+        for (x, y, n, _) in spec['shots']:
+            circle = Circle((x, y), radius=9, fill=True,
+                            facecolor='yellow', edgecolor='black', linewidth=1)
+            artists.append(ax.add_patch(circle))
+            if n > 0:
+                artists.append(ax.annotate(str(n), (x, y), color='blue',
+                                           fontsize=7, ha='center', va='center'))
+
+    return template.render(draw_overlay, format=format)
+
+
+@timed('generate_target')
+def generate_target(series, format='png', tz=None):
+    return render_target(target_spec(series, tz), format=format)
@@ -0,0 +1,192 @@
+"""Plot rendering in a pool of worker processes.
+
+matplotlib is CPU-bound and holds the GIL, rendering in the request would stall
+every other request of an eventlet worker. Routes send a plot spec of plain
+values to a render process and wait for the PNG bytes instead.
+
+Each render process is driven through its own pipe rather than a
+ProcessPoolExecutor, so that a render that times out can be stopped by
+replacing only the process that is stuck with it. The processes run this
+file as a script, unlike multiprocessing's spawn they do not import the
+main module of the server, which may be app.py.
+"""
+import os
+import queue
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from multiprocessing.connection import Connection
+from instrumentation import timer
+import plots
+
+# Optional, waiting for a render must not block the eventlet hub
+try:
+    from eventlet import patcher, tpool
+except ImportError:
+    patcher = tpool = None
+
+RENDERERS = {
+    'target': plots.render_target,
+    'weekly': plots.weekly_series_plot,
+}
+
+
+class RenderBusy(Exception):
+    pass
+
+
+class RenderTimeout(Exception):
+    pass
+
+
+class RenderError(Exception):
+    pass
+
+
+def _serve(conn):
+    # The parent handles Ctrl-C and stops the workers
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    import matplotlib
+    matplotlib.use('Agg')
+
+    while True:
+        try:
+            kind, spec = conn.recv()
+        except EOFError:
+            return
+
+        try:
+            conn.send((True, RENDERERS[kind](spec).getvalue()))
+        except Exception as e:
+            conn.send((False, f'{type(e).__name__}: {e}'))
+
+
+class _Worker:
+    def __init__(self):
+        parent, child = socket.socketpair()
+        with child:
+            self.process = subprocess.Popen(
+                [sys.executable, os.path.abspath(__file__), str(child.fileno())], pass_fds=(child.fileno(),))
+        self.conn = Connection(parent.detach())
+
+    def call(self, kind, spec, timeout):
+        self.conn.send((kind, spec))
+        if not self.conn.poll(timeout):
+            raise RenderTimeout(f"Rendering {kind} timed out")
+
+        ok, result = self.conn.recv()
+        if not ok:
+            raise RenderError(result)
+
+        return result
+
+    def stop(self):
+        self.conn.close()
+        self.process.kill()
+        self.process.wait()
+
+
+def default_processes():
+    """Render processes per web server process. Every gunicorn worker has its own pool,
+    WEB_CONCURRENCY (gunicorn's default worker count) of them share the cores."""
+    return max(1, (os.cpu_count() or 1) // max(1, int(os.environ.get('WEB_CONCURRENCY', 1))))
+
+
+def _green():
+    return patcher is not None and patcher.is_monkey_patched('thread')
+
+
+class RenderPool:
+    """Bounded pool of render processes.
+
+    At most RENDER_QUEUE_SIZE renders wait or run at a time, more raise RenderBusy.
+    A render that does not finish within RENDER_TIMEOUT seconds, including the wait
+    for a free process, raises RenderTimeout. With RENDER_PROCESSES = 0 plots are
+    rendered in the request, as before.
+
+    The processes are started on first use, or by start() from the server once a
+    worker process is ready, see gunicorn.conf.py.
+    """
+
+    def __init__(self, app=None):
+        self.app = None
+        self._slots = None
+        self._idle = None
+        self._pid = None
+        self._lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        self.app = app
+        app.config.setdefault('RENDER_PROCESSES', default_processes())
+        app.config.setdefault('RENDER_QUEUE_SIZE', 4 * max(app.config['RENDER_PROCESSES'], 1))
+        app.config.setdefault('RENDER_TIMEOUT', 10)
+        self._slots = threading.BoundedSemaphore(app.config['RENDER_QUEUE_SIZE'])
+        app.extensions['render_pool'] = self
+
+    def start(self):
+        """Start the render processes, so that they have imported matplotlib before the
+        first plot is requested."""
+        if self.app.config['RENDER_PROCESSES']:
+            self._start()
+
+    def _start(self):
+        with self._lock:
+            # Processes belong to the process that started them, also after a fork of the web server
+            if self._idle is not None and self._pid == os.getpid():
+                return
+
+            self._pid = os.getpid()
+            self._idle = queue.Queue()
+            for _ in range(self.app.config['RENDER_PROCESSES']):
+                self._idle.put(_Worker())
+
+    def render(self, kind, spec):
+        """Render a plot, returns the PNG bytes."""
+        if not self._slots.acquire(blocking=False):
+            raise RenderBusy("Too many plots are being rendered")
+
+        try:
+            with timer(f'render_{kind}'):
+                if self.app.config['RENDER_PROCESSES'] == 0:
+                    return RENDERERS[kind](spec).getvalue()
+                return self._render(kind, spec)
+        finally:
+            self._slots.release()
+
+    def _render(self, kind, spec):
+        self._start()
+        deadline = time.monotonic() + self.app.config['RENDER_TIMEOUT']
+
+        try:
+            worker = self._idle.get(timeout=self.app.config['RENDER_TIMEOUT'])
+        except queue.Empty:
+            raise RenderTimeout(f"No render process became free for {kind}") from None
+
+        timeout = max(deadline - time.monotonic(), 0)
+        try:
+            if _green():
+                # A real thread waits for the pipe, the other green threads keep running
+                result = tpool.execute(worker.call, kind, spec, timeout)
+            else:
+                result = worker.call(kind, spec, timeout)
+        except RenderError:
+            self._idle.put(worker)
+            raise
+        except Exception:
+            # The process is busy with the timed out render or gone, replace it
+            worker.stop()
+            self._idle.put(_Worker())
+            raise
+
+        self._idle.put(worker)
+        return result
+
+
+if __name__ == '__main__':
+    # A render process, the argument is its end of the pipe
+    _serve(Connection(int(sys.argv[1])))
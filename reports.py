@@ -0,0 +1,110 @@
+from datetime import datetime, time, timezone
+import numpy as np
+from flask import current_app
+from sqlalchemy import select
+from aggregation import offset_periods, to_utc
+from models import db, Series, Shot
+from shotstore import to_epoch
+
+GRANULARITIES = ('series', 'day', 'week', 'month')
+
+
+def load_points(user_id, since=None):
+    """Return series IDs, creation times (epoch seconds) and points of the user's shots
+    in series created since the given datetime, from the shot store if it is enabled."""
+    shot_store = current_app.extensions.get('shot_store')
+    if shot_store:
+        shots = shot_store.load(user_id, start=since)
+        return shots['series_id'], shots['created_at'], shots['points']
+
+    query = (
+        select(Series.id, Series.created_at, Shot.points)
+        .join(Shot, Shot.series_id == Series.id)
+        .where(Series.user_id == user_id)
+    )
+    if since is not None:
+        query = query.where(Series.created_at >= since)
+
+    rows = db.session.execute(query).all()
+    if not rows:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+
+    series_id, created_at, points = zip(*rows)
+    return np.array(series_id), to_epoch(created_at), np.array(points, dtype=float)
+
+
+def to_local(created_at, tz):
+    """Shift epoch timestamps to the wall clock time of tz, by the UTC offset in
+    effect at each of them."""
+    if len(created_at) == 0:
+        return created_at
+
+    first, last = (datetime.fromtimestamp(int(ts), timezone.utc).year
+                   for ts in (created_at.min(), created_at.max()))
+    periods = offset_periods(tz, first, last)
+    changes = to_epoch([start for start, _ in periods[1:]])
+    offsets = np.array([offset for _, offset in periods], dtype=np.int64) * 60
+    return created_at + offsets[np.searchsorted(changes, created_at, side='right')]
+
+
+def bucket_starts(created_at, granularity):
+    """Start of the day, ISO week or month of each epoch timestamp as datetime64[D].
+    Timestamps are bucketed as they are, shift them with to_local first."""
+    days = created_at.astype('datetime64[s]').astype('datetime64[D]')
+    if granularity == 'day':
+        return days
+    if granularity == 'week':
+        # 1970-01-01 was a Thursday
+        return days - (days.astype(np.int64) + 3) % 7
+    if granularity == 'month':
+        return days.astype('datetime64[M]').astype('datetime64[D]')
+
+    raise ValueError(f"Unknown granularity {granularity}")
+
+
+def grouped_medians(keys, values):
+    """Median of values for each distinct combination of keys, in key order.
+    keys is a list of arrays, the last one is the primary sort key."""
+    order = np.lexsort([values] + keys)
+    values = values[order]
+    keys = [key[order] for key in keys]
+
+    change = np.zeros(len(values), dtype=bool)
+    change[:1] = True
+    for key in keys:
+        change[1:] |= key[1:] != key[:-1]
+
+    # Values are sorted within each group, the median is the middle one or the mean of two
+    starts = np.flatnonzero(change)
+    counts = np.diff(np.r_[starts, len(values)])
+    medians = (values[starts + (counts - 1) // 2] + values[starts + counts // 2]) / 2
+
+    return [key[starts] for key in keys], medians
+
+
+def median_points(user_id, tz, granularity='series', since=None):
+    """Median shot points per series, day, ISO week or month of the timezone tz in
+    time order, of the series created since the local date since.
+    Returns a list of (label, median) tuples."""
+    if since is not None:
+        since = to_utc(datetime.combine(since, time.min, tzinfo=tz))
+
+    series_id, created_at, points = load_points(user_id, since)
+    if len(points) == 0:
+        return []
+
+    created_at = to_local(created_at, tz)
+
+    if granularity == 'series':
+        (_, created), medians = grouped_medians([series_id, created_at], points)
+        labels = [ts.strftime('%Y-%m-%d %H:%M') for ts in created.astype('datetime64[s]').tolist()]
+    else:
+        (buckets,), medians = grouped_medians([bucket_starts(created_at, granularity)], points)
+        if granularity == 'week':
+            labels = ['{}-W{:02d}'.format(*day.isocalendar()[:2]) for day in buckets.tolist()]
+        elif granularity == 'month':
+            labels = [day.strftime('%Y-%m') for day in buckets.tolist()]
+        else:
+            labels = [day.isoformat() for day in buckets.tolist()]
+
+    return list(zip(labels, medians.tolist()))
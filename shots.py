@@ -0,0 +1,69 @@
+"""Shot extraction from Ecoaims game JSON, shared by the importer and the CLI."""
+import io
+import json
+
+# Optional, parses large games without building the whole document first
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+# Games of at least this many bytes are parsed incrementally if ijson is installed
+STREAMING_THRESHOLD = 256 * 1024
+
+
+def _children(obj):
+    if isinstance(obj, dict):
+        return iter(obj.items())
+    return ((None, item) for item in obj)
+
+
+def iter_shots(obj):
+    """Yield every "shot" value except false from a parsed game, in document order.
+    Walks the document with an explicit stack instead of recursion."""
+    if not isinstance(obj, (dict, list)):
+        return
+
+    stack = [_children(obj)]
+    while stack:
+        for key, value in stack[-1]:
+            if key == 'shot':
+                if value is not False:
+                    yield value
+            elif isinstance(value, (dict, list)):
+                stack.append(_children(value))
+                break
+        else:
+            stack.pop()
+
+
+def _stream_shots(game):
+    events = ijson.basic_parse(io.BytesIO(game), use_float=True)
+    for event, value in events:
+        if event != 'map_key' or value != 'shot':
+            continue
+
+        # Build only the shot value, the rest of the document is never materialized
+        builder = ijson.ObjectBuilder()
+        depth = 0
+        for event, value in events:
+            builder.event(event, value)
+            if event in ('start_map', 'start_array'):
+                depth += 1
+            elif event in ('end_map', 'end_array'):
+                depth -= 1
+            if depth == 0:
+                break
+
+        if builder.value is not False:
+            yield builder.value
+
+
+def load_shots(game):
+    """Yield the shots of a game given as JSON text or bytes."""
+    if ijson is not None and len(game) >= STREAMING_THRESHOLD:
+        if isinstance(game, str):
+            game = game.encode()
+        return _stream_shots(game)
+
+    return iter_shots(json.loads(game))
@@ -0,0 +1,133 @@
+import os
+import numpy as np
+from sqlalchemy import func, select
+from models import db, Series, Shot
+from storage import file_lock
+
+# One record per shot, records of a series are contiguous.
+# Missing coordinates and times are NaN, created_at is seconds since the epoch (UTC).
+SHOT_DTYPE = np.dtype([
+    ('series_id', '<i8'),
+    ('created_at', '<i8'),
+    ('x', '<f8'),
+    ('y', '<f8'),
+    ('points', '<f8'),
+    ('t', '<f8')
+])
+
+
+def to_epoch(timestamps):
+    return np.array(timestamps, dtype='datetime64[s]').astype(np.int64)
+
+
+def make_records(series_ids, created_ats, shots):
+    """Build shot records from parallel lists of series IDs, timestamps and shot row dicts."""
+    records = np.empty(len(shots), dtype=SHOT_DTYPE)
+    if not shots:
+        return records
+
+    records['series_id'] = series_ids
+    records['created_at'] = to_epoch(created_ats)
+    for field in ('x', 'y', 'points', 't'):
+        records[field] = [np.nan if shot[field] is None else shot[field] for shot in shots]
+
+    return records
+
+
+class ShotStore:
+    """Per-user shot columns in a flat binary file next to the database.
+
+    The importer appends the shots of each committed batch, reports read the
+    file as a memory-mapped record array. The store is only a copy of the Shot
+    table: if its length does not match the shot count of the user's series it
+    is rebuilt from the database. Writes take a file lock, so the store can be
+    shared by the worker processes of a host.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, user_id):
+        return os.path.join(self.directory, f'{user_id}.shots')
+
+    def lock(self, user_id):
+        """Lock of the user's file. Writers hold it across the DB commit of the shots
+        and the append, so the file follows the commit order."""
+        return file_lock(self.path(user_id) + '.lock')
+
+    def append(self, user_id, records):
+        """Append records, the caller holds lock(user_id)."""
+        if len(records) == 0:
+            return
+
+        with open(self.path(user_id), 'ab') as f:
+            f.write(records.astype(SHOT_DTYPE, copy=False).tobytes())
+
+    def rebuild(self, user_id):
+        with self.lock(user_id):
+            self._rebuild(user_id)
+
+    def _rebuild(self, user_id):
+        # No import can commit shots of the user while the lock is held
+        rows = db.session.execute(
+            select(Series.id, Series.created_at, Shot.x, Shot.y, Shot.points, Shot.t)
+            .join(Shot, Shot.series_id == Series.id)
+            .where(Series.user_id == user_id)
+            .order_by(Series.created_at, Series.id, Shot.id)
+        ).all()
+
+        records = np.empty(len(rows), dtype=SHOT_DTYPE)
+        if rows:
+            columns = list(zip(*rows))
+            records['series_id'] = columns[0]
+            records['created_at'] = to_epoch(columns[1])
+            for i, field in enumerate(('x', 'y', 'points', 't'), start=2):
+                records[field] = [np.nan if value is None else value for value in columns[i]]
+
+        path = self.path(user_id)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(records.tobytes())
+        os.replace(path + '.tmp', path)
+
+    def _read(self, user_id):
+        path = self.path(user_id)
+        try:
+            size = os.path.getsize(path)
+        except FileNotFoundError:
+            return None
+
+        if size % SHOT_DTYPE.itemsize:
+            return None  # Torn append, rebuild
+        if size == 0:
+            return np.empty(0, dtype=SHOT_DTYPE)
+
+        return np.memmap(path, dtype=SHOT_DTYPE, mode='r')
+
+    def load(self, user_id, start=None, end=None):
+        """Return the user's shots, optionally only those of series created in [start, end)."""
+        expected = db.session.execute(
+            select(func.coalesce(func.sum(Series.n), 0)).where(Series.user_id == user_id)
+        ).scalar()
+
+        records = self._read(user_id)
+        if records is None or len(records) != expected:
+            self.rebuild(user_id)
+            records = self._read(user_id)
+
+        if start is not None or end is not None:
+            mask = np.ones(len(records), dtype=bool)
+            if start is not None:
+                mask &= records['created_at'] >= to_epoch(start)
+            if end is not None:
+                mask &= records['created_at'] < to_epoch(end)
+            records = records[mask]
+
+        return records
+
+
+def init_app(app):
+    """Enable the shot store if SHOT_STORE_DIR is set."""
+    directory = app.config.get('SHOT_STORE_DIR')
+    if directory:
+        app.extensions['shot_store'] = ShotStore(directory)
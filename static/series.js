@@ -265,3 +265,73 @@ function createMultiPlot(svg_id, shots, metrics) {
     drawCrosshair(svg, cfg);
   }
 }
+
+function appendTable(container, headers, rows) {
+  const table = document.createElement("table");
+  const headRow = table.createTHead().insertRow();
+  headers.forEach(header => {
+    const th = document.createElement("th");
+    th.textContent = header;
+    headRow.appendChild(th);
+  });
+
+  const body = table.createTBody();
+  rows.forEach(values => {
+    const row = body.insertRow();
+    values.forEach(value => {
+      row.insertCell().textContent = value === null ? "" : value;
+    });
+  });
+
+  container.appendChild(table);
+}
+
+// Draw a series from /data/target/<id> into container, replacing its content.
+function renderTarget(container, series) {
+  container.innerHTML = `
+    <svg id="mySVG" width="600" height="500"></svg>
+    <div id="tooltip" style="
+        position: absolute;
+        background: #fff;
+        border: 1px solid #333;
+        padding: 4px 8px;
+        font-size: 12px;
+        font-family: sans-serif;
+        pointer-events: none;
+        visibility: hidden;">
+    </div>`;
+
+  const append = (tag, text) => {
+    const element = document.createElement(tag);
+    element.textContent = text;
+    container.appendChild(element);
+    return element;
+  };
+
+  append("h2", `${series.description} Series ${series.id}`);
+  append("p", `Created at: ${series.created_at}`);
+  append("p", `Total points: ${series.total_points}`);
+  if (series.n) {
+    append("p", `Average points per shot: ${(series.total_points / series.n).toFixed(2)}`);
+  }
+  append("p", `Total time: ${series.total_t} seconds`);
+  append("p", `Number of shots: ${series.n}`);
+
+  // The server renders the PNG only for downloads
+  const download = append("a", "Download PNG");
+  download.href = `/target/${series.id}`;
+  download.download = `series-${series.id}.png`;
+
+  append("h3", "Shots");
+  appendTable(container, ["#", "Points", "Hit", "X", "Y", "Time"],
+    series.shots.map(shot => [shot.shotnum, shot.points, shot.hit, shot.x, shot.y, shot.t]));
+
+  append("h3", "Metrics");
+  appendTable(container, ["Name", "Value"], Object.entries(series.metrics));
+
+  create_series_plot({
+    shots: series.shots,
+    mpi_x: series.mpi_x || 0,
+    mpi_y: series.mpi_y || 0
+  });
+}
@@ -0,0 +1,112 @@
+"""Database engine settings for SQLite and PostgreSQL.
+
+STORAGE_PROFILE picks the trade-off between durability and write throughput
+for SQLite databases. All profiles use write-ahead logging, so readers are not
+blocked while the importer commits:
+
+    durable     synchronous=FULL, no committed transaction is lost on power failure
+    balanced    synchronous=NORMAL, the last transactions may be lost on power
+                failure but the database is never corrupted (default)
+    fast        synchronous=OFF, the OS decides when data reaches the disk, only
+                for data that can be imported again
+
+The profile has no effect on PostgreSQL, which is configured on the server.
+"""
+import os
+import threading
+from contextlib import contextmanager
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from models import db
+
+# Optional, not available on Windows where only threads are locked out
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+SQLITE_PROFILES = {
+    'durable': {'journal_mode': 'WAL', 'synchronous': 'FULL'},
+    'balanced': {'journal_mode': 'WAL', 'synchronous': 'NORMAL'},
+    'fast': {'journal_mode': 'WAL', 'synchronous': 'OFF'},
+}
+
+
+def sqlite_pragmas(config):
+    profile = config.get('STORAGE_PROFILE', 'balanced')
+    if profile not in SQLITE_PROFILES:
+        raise ValueError(f"Unknown storage profile {profile}")
+
+    pragmas = dict(SQLITE_PROFILES[profile])
+    pragmas.update({
+        'busy_timeout': config.get('SQLITE_BUSY_TIMEOUT', 5000),  # ms to wait for a lock
+        'mmap_size': config.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024),
+        'cache_size': -config.get('SQLITE_CACHE_SIZE', 64 * 1024),  # negative is KiB
+        'temp_store': 'MEMORY'
+    })
+
+    return pragmas
+
+
+def engine_options(config):
+    """SQLALCHEMY_ENGINE_OPTIONS for the configured database."""
+    url = make_url(config['SQLALCHEMY_DATABASE_URI'])
+    pool_size = config.get('DB_POOL_SIZE', 10)
+
+    if url.get_backend_name() == 'sqlite':
+        if url.database in (None, '', ':memory:'):
+            return {}
+        # There is only one writer, waiting for the file lock happens in busy_timeout
+        return {'pool_size': pool_size, 'max_overflow': 0, 'pool_timeout': 30}
+
+    if url.get_backend_name() == 'postgresql':
+        return {
+            'pool_size': pool_size,
+            'max_overflow': config.get('DB_MAX_OVERFLOW', 10),
+            'pool_pre_ping': True,
+            'pool_recycle': 1800
+        }
+
+    return {}
+
+
+def init_app(app):
+    """Apply the storage profile to new SQLite connections, call after db.init_app."""
+    with app.app_context():
+        engine = db.engine
+    if engine.dialect.name != 'sqlite':
+        return
+
+    pragmas = sqlite_pragmas(app.config)
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+        cursor.close()
+
+
+_thread_locks = {}
+_thread_locks_lock = threading.Lock()
+
+
+@contextmanager
+def file_lock(path):
+    """Exclusive lock held by one thread of one process at a time, for state shared by
+    the workers of a host. The lock file is created if needed and never removed."""
+    with _thread_locks_lock:
+        lock = _thread_locks.setdefault(path, threading.Lock())
+
+    # flock is per open file, the thread lock keeps threads of the same process out
+    with lock:
+        if fcntl is None:
+            yield
+            return
+
+        with open(path, 'a') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
@@ -0,0 +1,69 @@
+import itertools
+import os
+import sys
+import tempfile
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# The app reads its configuration on import, everything it writes goes to a temporary directory
+WORKDIR = tempfile.mkdtemp(prefix='shotrecord-tests-')
+os.environ.update({
+    'DATABASE_URI': 'sqlite:///' + os.path.join(WORKDIR, 'app.db'),
+    'SHOT_STORE_DIR': os.path.join(WORKDIR, 'shots'),
+    'RESULT_CACHE_DIR': os.path.join(WORKDIR, 'cache'),
+    'SECRET_KEY': 'test',
+    'SECRET_KEY_FILE': os.path.join(WORKDIR, 'secret_key'),
+    'METRICS_ENABLED': '0',
+    'RENDER_PROCESSES': '0',
+    # Tests drive the import queue themselves
+    'IMPORT_WORKERS': '0',
+})
+
+_usernames = (f'user{i}' for i in itertools.count())
+
+
+@pytest.fixture(scope='session')
+def app():
+    from app import app
+    return app
+
+
+def new_client(app):
+    """Test client logged in as a new user, the user's ID is client.user_id."""
+    from models import User
+
+    client = app.test_client()
+    username = next(_usernames)
+    client.post('/signup', data={'username': username, 'password': 'secret'})
+    client.post('/login', data={'username': username, 'password': 'secret'})
+    with app.app_context():
+        client.user_id = User.query.filter_by(username=username).first().id
+
+    return client
+
+
+@pytest.fixture
+def client(app):
+    return new_client(app)
+
+
+@pytest.fixture(scope='session')
+def ecoaims_db():
+    from benchmarks.generate import generate_ecoaims_db
+
+    path = os.path.join(WORKDIR, 'ecoaims.db')
+    generate_ecoaims_db(path, games=120)
+    return path
+
+
+@pytest.fixture
+def imported(app, client, ecoaims_db):
+    """Logged in client of a user with the games of ecoaims_db imported."""
+    from data_importer import import_ecoaims_db
+
+    with app.app_context():
+        import_ecoaims_db(ecoaims_db, client.user_id)
+
+    return client
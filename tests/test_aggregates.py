@@ -0,0 +1,47 @@
+from zoneinfo import ZoneInfo
+from sqlalchemy import delete, func, select
+
+
+def count_aggregates(user_id):
+    from models import db, DailyAggregate
+    return db.session.execute(
+        select(func.count()).select_from(DailyAggregate).where(DailyAggregate.user_id == user_id)).scalar()
+
+
+def test_reads_do_not_write_aggregates(app, imported):
+    from aggregation import local_date
+    from models import db, DailyAggregate, Series
+
+    imported.post('/settings', data={'timezone': 'Europe/Helsinki'})
+    with app.app_context():
+        latest = db.session.execute(
+            select(func.max(Series.created_at)).where(Series.user_id == imported.user_id)).scalar()
+        stored = db.session.get(DailyAggregate, (imported.user_id, local_date(latest, ZoneInfo('Europe/Helsinki'))))
+        n_shots = stored.n_shots
+        db.session.execute(delete(DailyAggregate).where(DailyAggregate.user_id == imported.user_id))
+        db.session.commit()
+
+    # A day with series is computed as before, an empty one has nothing to show
+    day = local_date(latest, ZoneInfo('Europe/Helsinki')).isoformat()
+    assert f'Shots: {n_shots}'.encode() in imported.get(f'/fragment/multiseries/{day}').data
+    assert imported.get('/fragment/multiseries/2000-01-01').status_code == 200
+
+    with app.app_context():
+        assert count_aggregates(imported.user_id) == 0
+
+
+def test_timezone_change_rebuilds_aggregates(app, imported):
+    from aggregation import local_date
+    from models import db, DailyAggregate, Series
+
+    imported.post('/settings', data={'timezone': 'Pacific/Kiritimati'})
+
+    tz = ZoneInfo('Pacific/Kiritimati')
+    with app.app_context():
+        created = db.session.execute(select(Series.created_at).where(Series.user_id == imported.user_id)).scalars()
+        dates = {local_date(created_at, tz) for created_at in created}
+        timezones = set(db.session.execute(
+            select(DailyAggregate.timezone).where(DailyAggregate.user_id == imported.user_id)).scalars())
+
+        assert count_aggregates(imported.user_id) == len(dates)
+        assert timezones == {'Pacific/Kiritimati'}
@@ -0,0 +1,13 @@
+def test_default_zone_is_named(monkeypatch):
+    from aggregation import get_zone, local_zone_name
+
+    local_zone_name.cache_clear()
+    monkeypatch.setenv('TZ', 'Europe/Helsinki')
+    try:
+        assert str(get_zone(None)) == 'Europe/Helsinki'
+        assert str(get_zone(None, 'Asia/Tokyo')) == 'Asia/Tokyo'
+        monkeypatch.setenv('TZ', 'EST+5')
+        local_zone_name.cache_clear()
+        assert local_zone_name() == 'UTC'
+    finally:
+        local_zone_name.cache_clear()
@@ -0,0 +1,25 @@
+import os
+import shutil
+from conftest import WORKDIR
+
+
+def test_file_cache_set_survives_invalidation(monkeypatch):
+    from cache import FileCache
+
+    cache = FileCache(os.path.join(WORKDIR, 'filecache'))
+    replace = os.replace
+
+    def invalidated_replace(src, dst):
+        # invalidate_user running between the write and the rename
+        shutil.rmtree(os.path.dirname(src))
+        replace(src, dst)
+
+    monkeypatch.setattr(os, 'replace', invalidated_replace)
+    cache.set(('report', 1, 'version'), [1, 2, 3])
+    monkeypatch.setattr(os, 'replace', replace)
+
+    assert cache.get(('report', 1, 'version')) is None
+    assert len(cache) == 0
+
+    cache.set(('report', 1, 'version'), [1, 2, 3])
+    assert cache.get(('report', 1, 'version')) == [1, 2, 3]
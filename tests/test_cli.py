@@ -0,0 +1,30 @@
+import json
+import os
+import sqlite3
+import pytest
+import cli
+
+
+def make_ecoaims_db(path, games):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE ekoaims_games (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+                 "game TEXT NOT NULL, settings TEXT NOT NULL, created TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
+    conn.executemany("INSERT INTO ekoaims_games (game, settings) VALUES (?, '{}')",
+                     [(json.dumps(game),) for game in games])
+    conn.commit()
+    conn.close()
+
+
+@pytest.mark.parametrize('jobs', [1, 2])
+def test_games_without_shots_are_skipped(tmp_path, jobs):
+    shot = {'x': 300, 'y': 250, 'points': 10.0, 'shotNumber': 1}
+    make_ecoaims_db(tmp_path / 'ecoaims.db', [
+        {'shots': [{'shot': shot}]},
+        {'shots': []},
+        {'shots': [{'shot': dict(shot, x=310)}, {'shot': False}]},
+    ])
+
+    cli.handle_ecoaims_db(str(tmp_path / 'ecoaims.db'), jobs=jobs, output_dir=str(tmp_path), dpi=20)
+
+    assert sorted(name for name in os.listdir(tmp_path) if name.endswith('.png')) == [
+        'shotrecord_00001.png', 'shotrecord_00003.png']
@@ -0,0 +1,92 @@
+import os
+import shutil
+import sqlite3
+from datetime import datetime
+from sqlalchemy import create_engine, func, select, text
+from conftest import WORKDIR
+
+
+def test_renumbered_database_is_not_imported_again(app, imported, ecoaims_db, tmp_path):
+    from data_importer import import_ecoaims_db
+
+    path = str(tmp_path / 'renumbered.db')
+    shutil.copy(ecoaims_db, path)
+    with sqlite3.connect(path) as conn:
+        conn.execute('UPDATE ekoaims_games SET id = id + 1000')
+
+    with app.app_context():
+        stats = import_ecoaims_db(path, imported.user_id)
+
+    assert stats['imported'] == 0 and stats['skipped'] == 120
+
+
+def test_concurrent_writes_skip_stored_games(app, client):
+    from data_importer import parse_ecoaims_game, write_series_batch
+    from models import db, Series
+
+    shots = [{'x': 300, 'y': 250, 'points': 10.0, 'time': 1.0, 'shotNumber': 1, 'hit': 1}]
+    games = [parse_ecoaims_game(i, shots, datetime(2024, 1, 1, 10, i)) for i in range(3)]
+
+    with app.app_context():
+        written, _, _ = write_series_batch(client.user_id, games[:2])
+        assert len(written) == 2
+        # The other import checked before these were committed
+        written, n_rows, records = write_series_batch(client.user_id, games)
+        db.session.commit()
+
+        assert [game[0]['created_at'] for game in written] == [games[2][0]['created_at']]
+        assert n_rows == 2 and len(records) == 1
+        assert db.session.execute(
+            select(func.count(Series.id)).where(Series.user_id == client.user_id)).scalar() == 3
+
+
+def test_import_source_is_shared(app, client):
+    from data_importer import get_import_source
+
+    with app.app_context():
+        assert get_import_source(client.user_id, 'f' * 40).id == get_import_source(client.user_id, 'f' * 40).id
+
+
+def test_upgrade_removes_duplicate_series(app):
+    from migrations import upgrade
+    from models import db
+
+    engine = create_engine('sqlite:///' + os.path.join(WORKDIR, 'duplicates.db'))
+    db.metadata.create_all(engine)
+    with engine.begin() as conn:
+        # The schema before the unique index
+        conn.execute(text('DROP INDEX ux_series_user_id_created_at'))
+        conn.execute(text('CREATE INDEX ix_series_user_id_created_at ON series (user_id, created_at)'))
+        conn.execute(text("INSERT INTO user (id, username, password) VALUES (1, 'a', 'x')"))
+        for series_id in (1, 2, 3):
+            created_at = '2024-01-01 10:00:00' if series_id < 3 else '2024-01-02 10:00:00'
+            conn.execute(text(
+                'INSERT INTO series (id, user_id, target_type, target_model, description, source_id, '
+                'created_at, total_points, n) '
+                "VALUES (:id, 1, 't', 'm', 'd', :id, :created_at, 10, 1)"),
+                {'id': series_id, 'created_at': created_at})
+            conn.execute(text(
+                'INSERT INTO shot (series_id, hit, points, shotnum) VALUES (:id, 1, 10, 1)'), {'id': series_id})
+
+    upgrade(engine)
+
+    with engine.connect() as conn:
+        assert conn.execute(text('SELECT id FROM series ORDER BY id')).scalars().all() == [1, 3]
+        assert conn.execute(text('SELECT series_id FROM shot ORDER BY series_id')).scalars().all() == [1, 3]
+        indexes = dict(conn.execute(text("SELECT name, sql FROM sqlite_master WHERE tbl_name = 'series'")).all())
+    assert 'UNIQUE' in indexes['ux_series_user_id_created_at'] and 'ix_series_user_id_created_at' not in indexes
+
+
+def test_generated_shots_are_centered(app, imported):
+    from benchmarks.generate import CENTER
+    from data_importer import transform_coordinates
+    from models import db, Series, Shot
+    from plots import TARGET_CENTER
+
+    assert transform_coordinates(*CENTER, 'ecoaims') == TARGET_CENTER
+    with app.app_context():
+        mean_x, mean_y = db.session.execute(
+            select(func.avg(Shot.x), func.avg(Shot.y))
+            .join(Series, Series.id == Shot.series_id).where(Series.user_id == imported.user_id)).one()
+
+    assert abs(mean_x - TARGET_CENTER[0]) < 10 and abs(mean_y - TARGET_CENTER[1]) < 10
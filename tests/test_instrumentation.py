@@ -0,0 +1,71 @@
+import os
+import pytest
+from conftest import WORKDIR
+
+
+@pytest.fixture
+def metrics_app(app):
+    from flask import Flask
+    from flask_login import LoginManager
+    import instrumentation
+    from models import db
+
+    metrics_app = Flask(__name__)
+    metrics_app.config.update(
+        SQLALCHEMY_DATABASE_URI='sqlite:///' + os.path.join(WORKDIR, 'metrics.db'),
+        METRICS_ENABLED=True, METRICS_LOG_LEVEL='WARNING', METRICS_TOKEN='scraper')
+    db.init_app(metrics_app)
+    LoginManager(metrics_app).user_loader(lambda user_id: None)
+    instrumentation.init_app(metrics_app)
+
+    @metrics_app.route('/query')
+    def query():
+        db.session.execute(db.text('SELECT 1'))
+        return 'ok'
+
+    @metrics_app.route('/failing')
+    def failing():
+        try:
+            db.session.execute(db.text('SELECT * FROM missing_table'))
+        except Exception:
+            db.session.rollback()
+        db.session.execute(db.text('SELECT 1'))
+        return 'ok'
+
+    return metrics_app
+
+
+def test_metrics_need_the_token(metrics_app):
+    client = metrics_app.test_client()
+    client.get('/query')
+
+    assert client.get('/metrics').status_code == 401
+    assert client.get('/metrics', headers={'Authorization': 'Bearer wrong'}).status_code == 401
+
+    response = client.get('/metrics', headers={'Authorization': 'Bearer scraper'})
+    assert response.status_code == 200
+    assert b'sql_query_duration_seconds_count{endpoint="query"} 1' in response.data
+
+
+def test_metrics_disabled(app):
+    # The test app runs with METRICS_ENABLED=0, its engine has no timing hooks
+    from sqlalchemy import event
+    import instrumentation
+    from models import db
+
+    with app.app_context():
+        assert not event.contains(db.engine, 'after_cursor_execute', instrumentation._after_cursor_execute)
+    assert app.test_client().get('/metrics').status_code == 404
+
+
+def test_failed_statements_are_not_timed(metrics_app):
+    from models import db
+
+    client = metrics_app.test_client()
+    client.get('/failing')
+
+    response = client.get('/metrics', headers={'Authorization': 'Bearer scraper'})
+    assert b'sql_query_duration_seconds_count{endpoint="failing"} 1' in response.data
+    # Nothing of the failed statement is left on the pooled connection
+    with metrics_app.app_context(), db.engine.connect() as conn:
+        assert not conn.info.get('query_start')
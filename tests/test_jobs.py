@@ -0,0 +1,90 @@
+import os
+import shutil
+import threading
+import time
+from datetime import datetime, timedelta
+import pytest
+
+
+def test_expired_lease_is_taken_over(app, client, ecoaims_db, tmp_path, monkeypatch):
+    from jobs import ImportQueue, LeaseLost
+    from models import db, ImportJob, Series
+
+    filename = str(tmp_path / 'upload.db')
+    shutil.copy(ecoaims_db, filename)
+
+    with app.app_context():
+        # Jobs of a process that died and of one that is still running
+        past = datetime.utcnow() - timedelta(minutes=1)
+        expired = ImportJob(user_id=client.user_id, filename=filename, status='running',
+                            lease_owner='gone:1:1', lease_expires=past, updated_at=past)
+        live = ImportJob(user_id=client.user_id, filename=str(tmp_path / 'live.db'), status='running',
+                         lease_owner='alive:1:1', lease_expires=datetime.utcnow() + timedelta(minutes=5))
+        db.session.add_all([expired, live])
+        db.session.commit()
+        expired_id, live_id = expired.id, live.id
+
+        # A second queue instance stands in for another worker process
+        queue = ImportQueue(app)
+        assert queue._claim() == expired_id
+        assert queue._claim() is None
+        queue._run(expired_id)
+
+        job = db.session.get(ImportJob, expired_id, populate_existing=True)
+        assert job.status == 'done' and job.lease_owner is None
+        assert job.series_imported == Series.query.filter_by(user_id=client.user_id).count() == 120
+        assert db.session.get(ImportJob, live_id).lease_owner == 'alive:1:1'
+
+        # The process that lost the lease can not update the job any more
+        monkeypatch.setattr(ImportQueue, 'owner', 'gone:1:1')
+        with pytest.raises(LeaseLost):
+            queue._update(expired_id, rows_done=0)
+
+
+def test_taken_over_job_commits_nothing(app, client, ecoaims_db, tmp_path):
+    from jobs import ImportQueue, LeaseLost
+    from models import db, ImportJob, Series
+
+    filename = str(tmp_path / 'upload.db')
+    shutil.copy(ecoaims_db, filename)
+
+    with app.app_context():
+        job = ImportJob(user_id=client.user_id, filename=filename)
+        db.session.add(job)
+        db.session.commit()
+
+        queue = ImportQueue(app)
+        job_id = queue._claim()
+        # Another process takes the job over before the first batch is committed
+        db.session.execute(db.update(ImportJob).where(ImportJob.id == job_id).values(lease_owner='other:1:1'))
+        db.session.commit()
+
+        with pytest.raises(LeaseLost):
+            queue._run(job_id)
+
+        job = db.session.get(ImportJob, job_id, populate_existing=True)
+        assert job.status == 'running' and job.lease_owner == 'other:1:1'
+        assert Series.query.filter_by(user_id=client.user_id).count() == 0
+        assert os.path.exists(filename)
+
+
+def test_heartbeat_renews_the_lease(app, client, monkeypatch):
+    from jobs import ImportQueue
+    from models import db, ImportJob
+
+    monkeypatch.setitem(app.config, 'IMPORT_LEASE_SECONDS', 0.3)
+    with app.app_context():
+        past = datetime.utcnow() - timedelta(minutes=1)
+        job = ImportJob(user_id=client.user_id, filename='unused', status='running',
+                        lease_owner='me:1:1', lease_expires=past)
+        db.session.add(job)
+        db.session.commit()
+
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=ImportQueue(app)._heartbeat, args=(job.id, 'me:1:1', stop))
+        heartbeat.start()
+        time.sleep(0.5)
+        stop.set()
+        heartbeat.join()
+
+        assert db.session.get(ImportJob, job.id, populate_existing=True).lease_expires > datetime.utcnow()
@@ -0,0 +1,72 @@
+import math
+import random
+from itertools import combinations
+import pytest
+
+
+def pairwise_metrics(shots, s_ref=50.0):
+    # The metric code before vectorization
+    n = len(shots)
+    mx = sum(x for x, _ in shots) / n
+    my = sum(y for _, y in shots) / n
+    r = [math.hypot(x - mx, y - my) for x, y in shots]
+    mr = sum(r) / n
+    rsd = math.sqrt(sum((ri - mr) ** 2 for ri in r) / n)
+    rms = math.sqrt(sum(ri * ri for ri in r) / n)
+
+    extreme = 0.0
+    for (x1, y1), (x2, y2) in combinations(shots, 2):
+        extreme = max(extreme, math.hypot(x1 - x2, y1 - y2))
+
+    return {
+        "MPI_x": mx,
+        "MPI_y": my,
+        "MeanRadius": mr,
+        "RadialStdDev": rsd,
+        "RMS": rms,
+        "ExtremeSpread": extreme,
+        "ConsistencyPct": max(0.0, 100.0 * (1.0 - rsd / s_ref))
+    }
+
+
+def random_series(rng, n):
+    return [(rng.gauss(300, 20), rng.gauss(250, 20)) for _ in range(n)]
+
+
+SERIES = [
+    [(300, 250)],
+    [(300, 250), (300, 250)],
+    [(300, 250), (300, 250), (310, 240)],
+    [(x, 2 * x + 1) for x in range(10)],
+    [(5, y) for y in (3, 1, 4, 1, 5, 9, 2, 6)],
+    [(0, 0), (10, 0), (10, 10), (0, 10), (5, 5), (0, 0), (10, 10)],
+    [(math.cos(a) * 50, math.sin(a) * 50) for a in (i * math.pi / 20 for i in range(40))],
+]
+_rng = random.Random(1)
+SERIES += [random_series(_rng, n) for n in (2, 3, 10, 31, 32, 33, 60, 200)]
+SERIES += [[(round(x), round(y)) for x, y in random_series(_rng, 100)]]
+
+
+@pytest.mark.parametrize('shots', SERIES)
+def test_compute_metrics_matches_pairwise(shots):
+    from metrics import compute_metrics
+
+    assert compute_metrics(shots, s_ref=33) == pytest.approx(pairwise_metrics(shots, s_ref=33), rel=1e-12, abs=1e-9)
+
+
+def test_compute_metrics_batch_matches_pairwise():
+    from metrics import compute_metrics_batch
+
+    batch = compute_metrics_batch([xy for shots in SERIES for xy in shots], [len(shots) for shots in SERIES], s_ref=33)
+    for shots, metrics in zip(SERIES, batch):
+        assert metrics == pytest.approx(pairwise_metrics(shots, s_ref=33), rel=1e-12, abs=1e-9)
+
+
+def test_extreme_spread_on_integer_grids():
+    # Small grids give many duplicate and collinear hull points
+    from metrics import extreme_spread
+
+    rng = random.Random(2)
+    for _ in range(500):
+        shots = [(rng.randint(0, 4), rng.randint(0, 4)) for _ in range(rng.randint(1, 40))]
+        assert extreme_spread(shots) == pytest.approx(pairwise_metrics(shots)['ExtremeSpread'], rel=1e-12)
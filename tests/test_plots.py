@@ -0,0 +1,26 @@
+import pytest
+
+
+def test_failed_overlay_leaves_the_template_clean():
+    from plots import get_target_template
+
+    template = get_target_template('test', dpi=20)
+    n_texts = len(template.ax.texts)
+
+    def draw_overlay(ax, artists):
+        artists.append(ax.annotate('partial', (10, 10)))
+        raise ValueError('overlay failed')
+
+    with pytest.raises(ValueError):
+        template.render(draw_overlay)
+    assert len(template.ax.texts) == n_texts
+
+
+def test_target_without_time():
+    from plots import get_target_template, render_target
+
+    spec = {'target_model': 'Ecoaims TAR-170/60L', 'description': 'Training', 'created_at': '2024-01-01 10:00',
+            'total_points': 10.0, 'total_t': None, 'consistency_pct': None,
+            'shots': [(300, 250, 1, 10.0)], 'mpi': (300, 250)}
+    assert render_target(spec).getvalue().startswith(b'\x89PNG')
+    assert not get_target_template('Ecoaims TAR-170/60L', xscale=2.2).ax.texts
@@ -0,0 +1,116 @@
+from types import SimpleNamespace
+import pytest
+from flask import Flask
+
+
+class FakeWorker:
+    def call(self, kind, spec, timeout):
+        return f'{kind}:{spec}'.encode()
+
+
+@pytest.fixture
+def green(monkeypatch):
+    """Pretend to run under eventlet, returns the calls made through tpool."""
+    import render
+
+    calls = []
+
+    def execute(function, *args):
+        calls.append(function.__name__)
+        return function(*args)
+
+    monkeypatch.setattr(render, 'patcher', SimpleNamespace(is_monkey_patched=lambda name: name == 'thread'))
+    monkeypatch.setattr(render, 'tpool', SimpleNamespace(execute=execute))
+    monkeypatch.setattr(render, '_Worker', FakeWorker)
+    return calls
+
+
+def test_green_render_waits_in_tpool(green):
+    from render import RenderPool
+
+    app = Flask(__name__)
+    app.config.update(RENDER_PROCESSES=2, RENDER_TIMEOUT=1)
+    pool = RenderPool(app)
+    assert pool._idle is None
+
+    pool.start()
+    assert pool._idle.qsize() == 2
+    assert pool.render('target', 7) == b'target:7'
+    assert green == ['call']
+    assert pool._idle.qsize() == 2
+
+
+@pytest.fixture
+def pool():
+    from render import RenderPool
+
+    app = Flask(__name__)
+    app.config.update(RENDER_PROCESSES=1, RENDER_QUEUE_SIZE=1, RENDER_TIMEOUT=30)
+    pool = RenderPool(app)
+    pool.start()
+    yield pool
+    while not pool._idle.empty():
+        pool._idle.get().stop()
+
+
+def test_render_process(pool):
+    from render import RenderBusy, RenderError, RenderTimeout
+
+    assert pool.render('weekly', []).startswith(b'\x89PNG')
+
+    # A failing render keeps its process
+    worker = pool._idle.queue[0]
+    with pytest.raises(RenderError, match='KeyError'):
+        pool.render('target', {})
+    assert pool._idle.queue[0] is worker
+
+    # Only RENDER_QUEUE_SIZE renders wait or run at a time
+    assert pool._slots.acquire(blocking=False)
+    try:
+        with pytest.raises(RenderBusy):
+            pool.render('weekly', [])
+    finally:
+        pool._slots.release()
+
+    # A stuck process is replaced
+    pool.app.config['RENDER_TIMEOUT'] = 0.001
+    with pytest.raises(RenderTimeout):
+        pool.render('weekly', [])
+    assert worker.process.poll() is not None
+    pool.app.config['RENDER_TIMEOUT'] = 30
+    replacement = pool._idle.queue[0]
+    assert replacement is not worker
+    assert pool.render('weekly', []).startswith(b'\x89PNG')
+
+
+@pytest.mark.parametrize('error, status', [('RenderBusy', 503), ('RenderTimeout', 504), ('RenderError', 500)])
+def test_render_errors(imported, app, monkeypatch, error, status):
+    import render
+    from models import Series
+
+    def fail(kind, spec):
+        raise getattr(render, error)('KeyError: secret detail')
+
+    monkeypatch.setattr(app.extensions['render_pool'], 'render', fail)
+    with app.app_context():
+        series_id = Series.query.filter_by(user_id=imported.user_id).first().id
+
+    response = imported.get(f'/target/{series_id}')
+    assert response.status_code == status
+    if status == 503:
+        assert response.headers['Retry-After'] == '1'
+    if status == 500:
+        assert b'secret' not in response.data
+
+
+def test_default_processes_share_the_cores(monkeypatch):
+    import os
+    from render import default_processes
+
+    monkeypatch.setattr(os, 'cpu_count', lambda: 8)
+    monkeypatch.setenv('WEB_CONCURRENCY', '4')
+    assert default_processes() == 2
+    monkeypatch.setenv('WEB_CONCURRENCY', '16')
+    assert default_processes() == 1
+    monkeypatch.setenv('WEB_CONCURRENCY', '0')
+    assert default_processes() == 8
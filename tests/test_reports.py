@@ -0,0 +1,30 @@
+from zoneinfo import ZoneInfo
+import numpy as np
+
+
+def test_buckets_are_local_across_dst():
+    from reports import bucket_starts, to_local
+    from shotstore import to_epoch
+
+    tz = ZoneInfo('Europe/Helsinki')
+    # UTC+2 in winter, UTC+3 after the change on 2024-03-31 01:00 UTC
+    created_at = to_epoch(['2024-01-31T22:30', '2024-03-31T00:30', '2024-03-31T21:30'])
+    local = to_local(created_at, tz)
+
+    assert local.astype('datetime64[s]').astype(str).tolist() == [
+        '2024-02-01T00:30:00', '2024-03-31T02:30:00', '2024-04-01T00:30:00']
+    assert bucket_starts(local, 'month').astype(str).tolist() == ['2024-02-01', '2024-03-01', '2024-04-01']
+
+
+def test_median_points_by_local_day(imported, app):
+    from reports import median_points
+
+    with app.app_context():
+        utc = median_points(imported.user_id, ZoneInfo('UTC'), 'day')
+        shifted = median_points(imported.user_id, ZoneInfo('Pacific/Kiritimati'), 'day')
+
+    # Sessions late in the UTC day fall on the next day at UTC+14
+    assert utc and shifted
+    assert [label for label, _ in utc] != [label for label, _ in shifted]
+    assert all(np.isfinite(value) for _, value in shifted)
+    assert imported.get('/report/series/median_points?granularity=week&since=2000-01-01').status_code == 200
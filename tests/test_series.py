@@ -0,0 +1,29 @@
+import pytest
+
+
+def test_keyset_pages_cover_all_series(imported):
+    seen = []
+    cursor = None
+    while True:
+        url = '/data/series?limit=50' + (f'&after={cursor}' if cursor else '')
+        data = imported.get(url).get_json()
+        seen += [item['id'] for item in data['items']]
+        cursor = data['nextCursor']
+        if not cursor:
+            break
+
+    assert len(seen) == len(set(seen)) == data['totalItems'] == 120
+
+
+@pytest.mark.parametrize('limit', [0, -1])
+def test_invalid_limit(imported, limit):
+    assert imported.get(f'/data/series?limit={limit}').status_code == 400
+
+
+def test_limit_is_capped(imported, monkeypatch):
+    import app as appmod
+    monkeypatch.setattr(appmod, 'MAX_SERIES_LIMIT', 10)
+
+    data = imported.get('/data/series?limit=100000').get_json()
+    assert len(data['items']) == 10
+    assert data['nextCursor']
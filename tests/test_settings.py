@@ -0,0 +1,6 @@
+def test_settings_messages(client):
+    response = client.post('/settings', data={'timezone': 'Europe/Helsinki'})
+    assert b'Settings saved' in response.data
+
+    response = client.post('/settings', data={'timezone': 'Mars/Olympus_Mons'})
+    assert b'Unknown timezone!' in response.data
@@ -0,0 +1,39 @@
+import os
+import threading
+from conftest import WORKDIR
+
+
+def test_concurrent_imports_keep_the_store_in_sync(app, client):
+    from sqlalchemy import func, select
+    from benchmarks.generate import generate_ecoaims_db
+    from data_importer import import_ecoaims_db
+    from models import db, Series
+
+    paths = []
+    for seed in (2, 3):
+        path = os.path.join(WORKDIR, f'ecoaims-{seed}.db')
+        generate_ecoaims_db(path, games=60, seed=seed)
+        paths.append(path)
+
+    errors = []
+
+    def run(path):
+        try:
+            with app.app_context():
+                import_ecoaims_db(path, client.user_id, batch_size=5)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(path,)) for path in paths]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+
+    with app.app_context():
+        store = app.extensions['shot_store']
+        expected = db.session.execute(
+            select(func.sum(Series.n)).where(Series.user_id == client.user_id)).scalar()
+        # Read the file as the imports left it, load() would rebuild a mismatch
+        assert len(store._read(client.user_id)) == expected == 2 * 60 * 10
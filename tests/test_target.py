@@ -0,0 +1,55 @@
+import pytest
+from conftest import new_client
+
+
+@pytest.fixture
+def series_id(app, imported):
+    from models import Series
+
+    with app.app_context():
+        return Series.query.filter_by(user_id=imported.user_id).order_by(Series.id).first().id
+
+
+def test_target_data(imported, series_id):
+    data = imported.get(f'/data/target/{series_id}').get_json()
+
+    assert data['id'] == series_id
+    assert len(data['shots']) == data['n'] > 0
+    assert set(data['shots'][0]) == {'shotnum', 'points', 'hit', 'x', 'y', 't'}
+    assert data['mpi_x'] == pytest.approx(sum(shot['x'] for shot in data['shots']) / data['n'])
+    assert data['mpi_y'] == pytest.approx(sum(shot['y'] for shot in data['shots']) / data['n'])
+    assert data['metrics']['MPI_x'] == data['mpi_x']
+    assert {'ExtremeSpread', 'MeanRadius', 'ConsistencyPct'} <= set(data['metrics'])
+
+
+@pytest.mark.parametrize('url', ['/data/target/{}', '/fragment/target/{}', '/series/{}'])
+def test_other_users_series_is_not_found(app, series_id, url):
+    assert new_client(app).get(url.format(series_id)).status_code == 404
+
+
+@pytest.mark.parametrize('url', ['/data/target/{}', '/series/{}'])
+def test_not_modified(imported, series_id, url):
+    url = url.format(series_id)
+    response = imported.get(url)
+    assert response.status_code == 200 and response.headers['ETag']
+
+    response = imported.get(url, headers={'If-None-Match': response.headers['ETag']})
+    assert response.status_code == 304 and not response.data
+
+
+def test_timezone_changes_created_at_and_etag(imported, series_id):
+    url = f'/data/target/{series_id}'
+    imported.post('/settings', data={'timezone': 'UTC'})
+    utc = imported.get(url)
+    imported.post('/settings', data={'timezone': 'Asia/Tokyo'})
+    tokyo = imported.get(url)
+
+    assert tokyo.get_json()['created_at'] != utc.get_json()['created_at']
+    assert tokyo.headers['ETag'] != utc.headers['ETag']
+    assert imported.get(url, headers={'If-None-Match': utc.headers['ETag']}).status_code == 200
+
+
+def test_series_page(imported, series_id):
+    response = imported.get(f'/series/{series_id}')
+    assert response.status_code == 200
+    assert b'renderTarget' in response.data